@@ -1,5 +1,7 @@
 from flask import Flask
 from .database import init_db
+from .indexes import ensure_indexes
+from .json_provider import ISODateJSONProvider
 from flask_cors import CORS
 from .config import *
 
@@ -8,6 +10,8 @@ def create_app():
 
     CORS(app, resources={r"/*": {"origins": "*"}})
     init_db(app)
+    app.json = ISODateJSONProvider(app)  # after init_db, flask_pymongo installs its own
+    ensure_indexes()
     app.config["SECRET_KEY"] = SECRET_KEY
     
     from app.auth_service import auth
@@ -20,5 +24,10 @@ def create_app():
     app.register_blueprint(info, url_prefix='/info')
     app.register_blueprint(llm, url_prefix='/llm')
     app.register_blueprint(map, url_prefix='/map')
+
+    from app.disaster_service.alerts import start_alert_worker
+    start_alert_worker(app)
+    from app.events import start_change_stream_listener
+    start_change_stream_listener(app)
     
     return app
\ No newline at end of file
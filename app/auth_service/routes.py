@@ -1,9 +1,10 @@
 from app.auth_service import auth
 from flask import request, jsonify, current_app
-from app.auth_service.utils import validate_user, read_db, write_db, find_user, update_db, generate_otp, store_otp, check_otp, is_ngo_email, send_otp_email
+from app.auth_service.utils import validate_user, write_db, find_user, update_db, update_user_location, generate_otp, store_otp, check_otp, is_ngo_email, send_otp_email
 from werkzeug.exceptions import InternalServerError, BadRequest, Conflict
+from pymongo.errors import DuplicateKeyError
 from app.models import user_model
-from datetime import datetime
+from datetime import datetime, timezone
 
 @auth.route('/login', methods=['POST'])
 def login():
@@ -22,8 +23,8 @@ def login():
             user = find_user(username)
             if user['is_active'] != True:
                 return jsonify({"message": "Account is deactivated for some reason"}), 403
-            user['last_login'] = datetime.utcnow().isoformat()
-            update_db(id_key='_id',id_value=user['_id'], key_name='last_login', value=datetime.utcnow().isoformat())
+            user['last_login'] = datetime.now(timezone.utc)
+            update_db(id_key='_id',id_value=user['_id'], key_name='last_login', value=user['last_login'])
             return jsonify({
                 "message": "Login successful",
                 "username": username,
@@ -54,13 +55,16 @@ def register():
                 "message": "Username and password are required"
             }), 400
 
-        users = read_db()
-        if any(user['username'] == username for user in users):
+        if find_user(username) is not None:
             return jsonify({"message": "Username already exists"}), 409
 
         # consider user document using user model...
         user_doc = user_model(data)
-        write_db(user_doc)
+        try:
+            write_db(user_doc)
+        except DuplicateKeyError:
+            # registered concurrently between the check and the insert
+            return jsonify({"message": "Username already exists"}), 409
         return jsonify({
             "message": "Registration successful",
             "username": username,
@@ -140,19 +144,30 @@ def verify_otp_ngo():
         print(e)
         raise InternalServerError(description=f"failed to verify the otp: {e}")
 
-# ### put this function in utils somewhere ###
-# @auth.route("/update_user_location", methods=["POST"])
-# def update_location():
-#     try:
-#         data = request.get_json()
-#         username = data["username"]
-#         lat = data["lat"]
-#         lon = data["lon"]
-#         if not username or lat is None or lon is None:
-#             return jsonify({"error": "Missing location or username"}), 400
-        
-#         value = {"lat": float(lat), "lon": float(lon), "source": "ip_based"}
-#         update_db("username", username, "last_active_location", value)
-#         return jsonify({"message": f"{username}'s location has been updated."})
-#     except Exception as e:
-#         raise InternalServerError(description=f"Failed to update the location: {e}")
\ No newline at end of file
+@auth.route("/update_user_location", methods=["POST"])
+def update_location():
+    try:
+        data = request.get_json()
+        if not data:
+            raise BadRequest("Missing JSON body")
+
+        username = data.get("username")
+        lat = data.get("lat")
+        lon = data.get("lon")
+        if not username or lat is None or lon is None:
+            return jsonify({"message": "Missing location or username"}), 400
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            raise BadRequest("lat and lon must be numbers")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise BadRequest("Invalid lat/lon")
+
+        if not update_user_location(username, lat, lon, data.get("source") or "gps"):
+            return jsonify({"message": f"Invalid username {username}"}), 404
+        return jsonify({"message": f"{username}'s location has been updated."}), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to update the location: {e}")
@@ -1,6 +1,7 @@
 from werkzeug.security import check_password_hash
 from werkzeug.exceptions import InternalServerError
 from app.database import mongo
+from pymongo.errors import DuplicateKeyError
 import random, hashlib, time
 import requests
 import json
@@ -9,31 +10,23 @@ from email.mime.multipart import MIMEMultipart
 from jinja2 import Template
 import os
 import smtplib
-from datetime import datetime
+from datetime import datetime, timezone
 import requests
 
-def read_db():
-    try:
-        docs = mongo.db.users.find({}, {"_id": 0})
-        return docs
-    except Exception as e:
-        print(e)
-        raise InternalServerError(description=f"Database read failed: {e}")
-
 def write_db(user_doc: dict):
     try:
         mongo.db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise  # username taken, the unique index decides between concurrent registrations
     except Exception as e:
         print(e)
         raise InternalServerError(description=f"Database write failed: {e}")
 
 def validate_user(username: str, password: str):
     try:
-        users = read_db()
-        for user in users:
-            if user['username'] == username and check_password_hash(user["password_hash"], password):
-                return True
-        return False
+        # one lookup on the unique username index...
+        user = mongo.db.users.find_one({"username": username}, {"password_hash": 1})
+        return user is not None and check_password_hash(user["password_hash"], password)
     except Exception as e:
         print(e)
         raise InternalServerError(description=f"Validation check failed: {e}")
@@ -47,6 +40,21 @@ def update_db(id_key: str, id_value, key_name: str, value):
     except Exception as e:
         raise InternalServerError(description=f"Update failed: {e}")
 
+def update_user_location(username: str, lat: float, lon: float, source: str = "gps"):
+    """Store where a user last was, as last_active_location and the indexed GeoJSON `location`. False if the user does not exist."""
+    try:
+        result = mongo.db.users.update_one(
+            {"username": username},
+            {"$set": {
+                "last_active_location": {"lat": float(lat), "lon": float(lon), "source": source},
+                "location": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+                "location_updated_at": datetime.now(timezone.utc)
+            }}
+        )
+        return result.matched_count == 1
+    except Exception as e:
+        raise InternalServerError(description=f"Location update failed: {e}")
+
 def find_user(username: str):
     try:
         user = mongo.db.users.find_one({"username": username})
@@ -0,0 +1,191 @@
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from app.geo import geohash_encode, geohash_bounds, geohash_center, haversine
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache with an optional TTL and hit/miss counters.
+
+    Args:
+        maxsize (int): entries kept before the least recently used one is evicted
+        ttl (float): seconds an entry stays valid, None to keep it until evicted
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+class GeoCellCache:
+    """
+    Cache of proximity query results, grouped by the geohash cell of the query point.
+
+    A write at a point only drops the entries of cells whose query radius (plus the
+    cell half diagonal) reaches that point, radius None means "everything" and is
+    dropped by any write. Every invalidation bumps `generation`, a result computed
+    while one happened is refused by `set` (it may predate the write).
+
+    Args:
+        precision (int): geohash length of a cell (6 is about 1.2 km x 0.6 km)
+        maxsize (int): entries kept before LRU eviction
+        ttl (float): seconds an entry stays valid
+    """
+
+    def __init__(self, precision: int = 6, maxsize: int = 2048, ttl: float = 15):
+        self.precision = precision
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._cell_keys = {}  # cell -> set of keys
+        self._key_radius = {}  # key -> radius in km (None = unbounded)
+        self._cell_geometry = {}  # cell -> (center_lat, center_lon, half_diagonal_km)
+        self.invalidations = 0
+        self.invalidated_entries = 0
+        self.generation = 0
+
+    def cell(self, lat: float, lon: float) -> str:
+        return geohash_encode(float(lat), float(lon), self.precision)
+
+    def center(self, cell: str):
+        return geohash_center(cell)
+
+    def half_diagonal(self, cell: str) -> float:
+        """km from the center of a cell to its corners, the farthest any point of it can be."""
+        min_lat, min_lon, max_lat, max_lon = geohash_bounds(cell)
+        center_lat, center_lon = geohash_center(cell)
+        return float(haversine(center_lat, center_lon, max_lat, max_lon))
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, cell: str, radius_km, value, generation: int = None):
+        """Store a result, skipped (returns False) when `generation` is no longer current."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._cache.set(key, value)
+            if cell not in self._cell_geometry:
+                self._cell_geometry[cell] = (*geohash_center(cell), self.half_diagonal(cell))
+            self._cell_keys.setdefault(cell, set()).add(key)
+            self._key_radius[key] = radius_km
+            if len(self._key_radius) > 2 * self._cache.maxsize:
+                self._forget_evicted()
+        return True
+
+    def _forget_evicted(self):
+        # LRU evictions/expirations don't tell us, drop their bookkeeping lazily
+        with self._cache._lock:
+            live = set(self._cache._data)
+        for cell in list(self._cell_keys):
+            keys = self._cell_keys[cell] & live
+            if keys:
+                self._cell_keys[cell] = keys
+            else:
+                del self._cell_keys[cell]
+                self._cell_geometry.pop(cell, None)
+        self._key_radius = {key: radius for key, radius in self._key_radius.items() if key in live}
+
+    def invalidate(self, lat: float, lon: float):
+        """Drop the entries whose query area may contain (lat, lon)."""
+        with self._lock:
+            self.invalidations += 1
+            self.generation += 1
+            cells = list(self._cell_keys)
+            if not cells:
+                return 0
+            geometry = np.array([self._cell_geometry[cell] for cell in cells])
+            distances = haversine(geometry[:, 0], geometry[:, 1], float(lat), float(lon))
+
+            dropped = []
+            for cell, distance, half_diagonal in zip(cells, distances.tolist(), geometry[:, 2].tolist()):
+                keys = self._cell_keys[cell]
+                stale = {key for key in keys
+                         if self._key_radius.get(key) is None or distance <= self._key_radius[key] + half_diagonal}
+                if not stale:
+                    continue
+                dropped.extend(stale)
+                keys -= stale
+                for key in stale:
+                    self._key_radius.pop(key, None)
+                if not keys:
+                    del self._cell_keys[cell]
+                    del self._cell_geometry[cell]
+
+        for key in dropped:
+            self._cache.pop(key)
+        self.invalidated_entries += len(dropped)
+        return len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._cache.clear()
+            self._cell_keys.clear()
+            self._key_radius.clear()
+            self._cell_geometry.clear()
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update({
+            "precision": self.precision,
+            "ttl": self._cache.ttl,
+            "cells": len(self._cell_keys),
+            "invalidations": self.invalidations,
+            "invalidated_entries": self.invalidated_entries
+        })
+        return stats
@@ -3,4 +3,63 @@ from datetime import timedelta
 
 SECRET_KEY = "secret_key_nigga"
 ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)
-REFRESH_TOKEN_EXPIRES = timedelta(days=7)
\ No newline at end of file
+REFRESH_TOKEN_EXPIRES = timedelta(days=7)
+
+# disaster alerts (SACHET) background refresh...
+ALERT_REFRESH_INTERVAL = int(os.environ.get("ALERT_REFRESH_INTERVAL", 300))  # seconds
+ALERT_WORKER_ENABLED = os.environ.get("ALERT_WORKER_ENABLED", "1") == "1"
+CAP_FETCH_WORKERS = int(os.environ.get("CAP_FETCH_WORKERS", 8))  # parallel CAP document downloads
+CAP_FETCH_DEADLINE = float(os.environ.get("CAP_FETCH_DEADLINE", 20))  # seconds per refresh
+CAP_CACHE_SIZE = int(os.environ.get("CAP_CACHE_SIZE", 512))  # parsed CAP documents kept in memory
+FEED_CANDIDATE_LIMIT = int(os.environ.get("FEED_CANDIDATE_LIMIT", 40))  # unique headlines read from the feed per refresh
+
+# delta sync of open requests...
+TOMBSTONE_TTL_DAYS = int(os.environ.get("TOMBSTONE_TTL_DAYS", 7))  # older `since` values need a full sync
+
+# geo-cell cache of /info/get_common_requests...
+REQUEST_CACHE_PRECISION = int(os.environ.get("REQUEST_CACHE_PRECISION", 6))  # geohash length, 6 ~ 1.2 x 0.6 km
+REQUEST_CACHE_SIZE = int(os.environ.get("REQUEST_CACHE_SIZE", 2048))
+REQUEST_CACHE_TTL = float(os.environ.get("REQUEST_CACHE_TTL", 15))  # seconds
+REQUEST_CACHE_MAX_RADIUS_KM = float(os.environ.get("REQUEST_CACHE_MAX_RADIUS_KM", 50))  # wider listings skip the cache
+
+# server-sent events of disaster requests...
+REQUEST_EVENTS_PRECISION = int(os.environ.get("REQUEST_EVENTS_PRECISION", 4))  # geohash length of fan-out cells
+REQUEST_EVENTS_QUEUE_SIZE = int(os.environ.get("REQUEST_EVENTS_QUEUE_SIZE", 100))  # buffered events per subscriber
+REQUEST_EVENTS_CHANGE_STREAM = os.environ.get("REQUEST_EVENTS_CHANGE_STREAM", "1") == "1"
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_RADIUS_KM = 100
+
+# request clusters for the map...
+CLUSTER_MAX_ZOOM = 16    # finest tile grid kept in sync, deeper map zooms reuse it
+CLUSTER_GRID_OFFSET = 2  # clusters per screen tile = 4**offset (a 256px tile gets 64px cells)
+CLUSTER_MAX_CELLS = 2048 # grid cells one query may cover, coarser grids are used beyond that
+
+# request priority score...
+PRIORITY_HALF_LIFE_HOURS = float(os.environ.get("PRIORITY_HALF_LIFE_HOURS", 72))  # a bump this old counts half
+PRIORITY_EPOCH = os.environ.get("PRIORITY_EPOCH", "2025-01-01T00:00:00+00:00")  # origin of the log2 priority scores
+
+# archival of resolved requests...
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", 30))  # resolved this long ago moves to the archive
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAUSE_SECONDS = 0.5  # sleep between batches so live traffic keeps its share of the database
+
+MAX_ACTIVE_REQUESTS = 3  # open requests a user may have at once
+
+# offline sync batches...
+SYNC_MAX_OPERATIONS = 100  # operations accepted per batch
+SYNC_KEY_TTL_DAYS = int(os.environ.get("SYNC_KEY_TTL_DAYS", 7))  # how long idempotency keys are remembered
+
+# free-text search of requests...
+SEARCH_CANDIDATES = 200         # text index hits rescored with RapidFuzz per query
+SEARCH_TYPO_CUTOFF = 75         # fuzz.ratio a vocabulary word needs to stand in for a misspelt query word
+SEARCH_VOCABULARY_SIZE = 50000  # most used words considered for typo correction
+SEARCH_VOCABULARY_TTL = 300     # seconds a worker keeps the vocabulary
+
+# situational rollups for dashboards...
+ROLLUP_PRECISION = 5    # geohash length of a rollup cell, 5 ~ 4.9 x 4.9 km
+ROLLUP_MAX_CELLS = 256  # cell prefixes one bounding box query may use, coarser prefixes beyond that
+
+# nearest responder matching...
+RESPONDER_MATCH_K = 5  # verified NGO responders suggested for a new request
+RESPONDER_MATCH_MAX_K = 50
+RESPONDER_MAX_DISTANCE_KM = float(os.environ.get("RESPONDER_MAX_DISTANCE_KM", 50))
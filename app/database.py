@@ -7,4 +7,24 @@ mongo = PyMongo()
 
 def init_db(app):
     app.config["MONGO_URI"] = os.environ.get("MONGO_URI")
-    mongo.init_app(app)
\ No newline at end of file
+    mongo.init_app(app)
+_supports_transactions = None
+
+def supports_transactions() -> bool:
+    """True when the deployment is a replica set or sharded cluster (checked once per process)."""
+    global _supports_transactions
+    if _supports_transactions is None:
+        hello = mongo.cx.admin.command("hello")
+        _supports_transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _supports_transactions
+
+def run_in_transaction(callback):
+    """
+    Run `callback(session)` inside a transaction (retried on transient errors) when the
+    deployment supports them, otherwise once with session=None. Callbacks must undo
+    their own partial writes when called without a session.
+    """
+    if not supports_transactions():
+        return callback(None)
+    with mongo.cx.start_session() as session:
+        return session.with_transaction(callback)
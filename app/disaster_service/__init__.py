@@ -2,4 +2,5 @@ from flask import Blueprint
 
 disaster = Blueprint('disaster', __name__)
 
-from app.disaster_service import routes  # by this routes.py has been executed and routes are registered
\ No newline at end of file
+from app.disaster_service import routes  # by this routes.py has been executed and routes are registered
+from app.disaster_service import commands  # flask cli commands (flask disaster ...)
\ No newline at end of file
@@ -0,0 +1,117 @@
+import numpy as np
+import shapely
+from shapely.geometry import Point, Polygon
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+from app.geo import haversine
+
+def alert_geometry(alert: dict):
+    """
+    Build the shapely geometry of an alert area (lon/lat order) from its CAP polygons,
+    falling back to the first coordinate for alerts stored without polygons.
+    """
+    polygons = []
+    for ring in alert.get("polygons") or []:
+        coords = [(lon, lat) for lat, lon in ring]
+        if len(coords) < 3:
+            continue
+        polygon = Polygon(coords)
+        if not polygon.is_valid:
+            polygon = polygon.buffer(0)  # CAP polygons are hand drawn, fix self-intersections...
+        if not polygon.is_empty:
+            polygons.append(polygon)
+    if polygons:
+        return unary_union(polygons)
+
+    coord = alert.get("first_coord")
+    if coord and len(coord) == 2:
+        return Point(coord[1], coord[0])
+    return None
+
+class AlertIndex:
+    """
+    STRtree over the alert areas of one snapshot.
+
+    Answers "alerts whose area contains me (smallest area first), then the
+    others nearest first by distance to their boundary", alerts without any
+    location go to the end as before.
+    """
+
+    def __init__(self, alerts: list):
+        self.alerts = alerts
+        self.positions = []  # tree item -> position in self.alerts
+        geometries = []
+        for position, alert in enumerate(alerts):
+            geometry = alert_geometry(alert)
+            if geometry is None:
+                continue
+            self.positions.append(position)
+            geometries.append(geometry)
+        self.geometries = np.empty(len(geometries), dtype=object)
+        self.geometries[:] = geometries
+        self.tree = STRtree(self.geometries) if geometries else None
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def _nearest_candidates(self, point, wanted: int):
+        # grow the search radius (degrees) until it holds enough areas...
+        radius = 0.5
+        while True:
+            candidates = self.tree.query(point, predicate="dwithin", distance=radius)
+            if len(candidates) >= wanted or radius >= 360:
+                break
+            radius *= 2
+        # a degree of longitude is only cos(lat) as long, widen so nothing nearer in km is left out
+        widened = min(radius / max(np.cos(np.radians(point.y)), 0.01), 360)
+        return self.tree.query(point, predicate="dwithin", distance=widened) if widened > radius else candidates
+
+    def _distances_km(self, items, point):
+        # great-circle distance to the closest point of each area (found in lon/lat space)
+        nearest = shapely.get_point(shapely.shortest_line(self.geometries[items], point), 0)
+        return haversine(point.y, point.x, shapely.get_y(nearest), shapely.get_x(nearest))
+
+    def rank(self, target_lat: float, target_lon: float, limit: int = None):
+        """
+        Rank the alerts of the snapshot for a location.
+
+        Args:
+            target_lat (float): Latitude to rank by
+            target_lon (float): Longitude to rank by
+            limit (int): maximum number of alerts to return (>= 0), None for all
+
+        Returns:
+            list: copies of the alerts (without 'first_coord'/'polygons'), each with 'inside_area'
+        """
+        if limit is not None and limit < 0:
+            raise ValueError("limit must not be negative")
+        ranked = []  # (position, inside)
+        if self.tree is not None:
+            point = Point(target_lon, target_lat)
+            inside = self.tree.query(point, predicate="intersects")
+            inside = sorted(inside.tolist(), key=lambda item: self.geometries[item].area)
+            ranked.extend((self.positions[item], True) for item in inside)
+
+            wanted = len(self.positions) if limit is None else limit
+            if len(inside) < wanted:
+                if limit is None:
+                    candidates = np.arange(len(self.positions))
+                else:
+                    candidates = self._nearest_candidates(point, wanted)
+                candidates = np.setdiff1d(candidates, inside)
+                distances = self._distances_km(candidates, point)
+                order = np.argsort(distances, kind="stable")
+                ranked.extend((self.positions[item], False) for item in candidates[order].tolist())
+
+        if limit is None or len(ranked) < limit:
+            located = set(self.positions)
+            ranked.extend((position, False) for position in range(len(self.alerts)) if position not in located)
+
+        result = []
+        for position, is_inside in ranked[:limit]:
+            alert = dict(self.alerts[position])
+            alert.pop("first_coord", None)
+            alert.pop("polygons", None)
+            alert["inside_area"] = is_inside
+            result.append(alert)
+        return result
@@ -0,0 +1,337 @@
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from app.database import mongo
+from app.cache import LRUCache
+from app.disaster_service.alert_index import AlertIndex
+from app.config import ALERT_REFRESH_INTERVAL, ALERT_WORKER_ENABLED, CAP_FETCH_WORKERS, CAP_FETCH_DEADLINE, CAP_CACHE_SIZE, FEED_CANDIDATE_LIMIT
+from app.disaster_service.utils import extract_first_coordinate, extract_polygon, is_english, HeadlineIndex, store_alert_history
+
+SACHET_FEED_URL = "https://sachet.ndma.gov.in/cap_public_website/rss/rss_india.xml"
+CAP_NS = {"cap": "urn:oasis:names:tc:emergency:cap:1.2"}
+MAX_ALERTS = 10
+SNAPSHOT_RELOAD_SECONDS = 30  # how often an empty worker looks for a stored snapshot again
+
+# latest parsed alert list shared by all requests of this process...
+_snapshot = {"alerts": [], "refreshed_at": None, "index": None, "reloaded_at": None}
+_snapshot_lock = threading.Lock()
+_worker = None
+
+# validators and parsed items of the last RSS download, used for conditional GETs...
+_feed_cache = {"etag": None, "last_modified": None, "size": 0, "items": None}
+_feed_stats = {
+    "requests": 0,
+    "not_modified": 0,      # 304 answers
+    "early_exits": 0,       # downloads stopped once enough candidates were found
+    "bytes_downloaded": 0,
+    "bytes_saved": 0
+}
+# parsed CAP alerts keyed by link, a published CAP document never changes...
+_cap_cache = LRUCache(maxsize=CAP_CACHE_SIZE)
+
+class _CountingReader:
+    """File-like wrapper over the raw response counting the bytes handed to the parser."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+def iter_feed_items(stream):
+    """
+    Yield (title, link) for each RSS item while the feed is being parsed,
+    parsed items are dropped from the tree right away so memory stays flat.
+    """
+    channel = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "channel":
+                channel = elem
+            continue
+        if elem.tag != "item":
+            continue
+
+        title = elem.findtext("title")
+        link = elem.findtext("link")
+        if title and link:
+            yield title.strip(), link.strip()
+        elem.clear()
+        if channel is not None:
+            channel.clear()
+
+def fetch_feed_items(limit: int = FEED_CANDIDATE_LIMIT):
+    """
+    Stream the SACHET RSS feed and return {title: link} for the first `limit`
+    unique English headlines, the download stops as soon as they are found.
+
+    Sends If-None-Match / If-Modified-Since from the previous download, a 304
+    reuses the headlines collected last time.
+    """
+    headers = {}
+    if _feed_cache["items"] is not None:
+        if _feed_cache["etag"]:
+            headers["If-None-Match"] = _feed_cache["etag"]
+        if _feed_cache["last_modified"]:
+            headers["If-Modified-Since"] = _feed_cache["last_modified"]
+
+    with requests.get(SACHET_FEED_URL, headers=headers, timeout=10, stream=True) as response:
+        _feed_stats["requests"] += 1
+        if response.status_code == 304 and _feed_cache["items"] is not None:
+            _feed_stats["not_modified"] += 1
+            _feed_stats["bytes_saved"] += _feed_cache["size"]
+            return dict(_feed_cache["items"])
+        response.raise_for_status()
+
+        response.raw.decode_content = True
+        stream = _CountingReader(response.raw)
+        headlines = HeadlineIndex()
+        temp = {}
+        try:
+            for title, link in iter_feed_items(stream):
+                if title in temp:
+                    temp[title] = link  # same title again, the later link wins as it always did
+                    continue
+                if not is_english(title) or not headlines.add(title):
+                    continue
+                temp[title] = link
+                if len(temp) == limit:
+                    _feed_stats["early_exits"] += 1
+                    break
+        except ET.ParseError:
+            raise ValueError("RSS feed is empty" if stream.bytes_read == 0 else "Invalid XML in RSS feed")
+        finally:
+            _feed_stats["bytes_downloaded"] += stream.bytes_read
+
+        _feed_cache.update({
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "size": stream.bytes_read,
+            "items": temp
+        })
+    return dict(temp)
+
+def parse_cap_document(link: str, xml_text: str):
+    """Parse one CAP XML document into an alert dict, None if it is not usable."""
+    if not xml_text.strip():
+        print(f"Skipping empty CAP XML at {link}")
+        return None
+
+    try:
+        cap_root = ET.fromstring(xml_text)
+    except ET.ParseError:
+        print(f"Skipping invalid CAP XML at {link}")
+        return None
+
+    # Extract event, headline, instruction, areaDesc, polygon, timestamp
+    info = cap_root.find("cap:info", CAP_NS)
+    if info is None:
+        return None
+
+    event_elem = info.find("cap:event", CAP_NS)
+    event = event_elem.text.strip() if event_elem is not None else ""
+
+    headline_elem = info.find("cap:headline", CAP_NS)
+    headline_text = headline_elem.text.strip() if headline_elem is not None else ""
+
+    area_elem = info.find("cap:area/cap:areaDesc", CAP_NS)
+    area_desc = area_elem.text.strip() if area_elem is not None else ""
+
+    polygon_elem = info.find("cap:area/cap:polygon", CAP_NS)
+    first_coord = extract_first_coordinate(polygon_elem.text if polygon_elem is not None else "")
+
+    # every polygon of every area, ranked against with the alert index...
+    polygons = []
+    for elem in info.findall("cap:area/cap:polygon", CAP_NS):
+        ring = extract_polygon(elem.text)
+        if ring:
+            polygons.append(ring)
+
+    timestamp_elem = cap_root.find("cap:sent", CAP_NS)
+    timestamp = timestamp_elem.text.strip() if timestamp_elem is not None else ""
+
+    return {
+        "title": headline_text,
+        "link": link,
+        "event": event,
+        "timestamp": timestamp,
+        "areas": area_desc,
+        "first_coord": first_coord,
+        "polygons": polygons
+    }
+
+def fetch_cap_document(link: str):
+    """Download and parse a single CAP document (runs on the fetch pool), cached by link."""
+    cached = _cap_cache.get(link)
+    if cached is not None:
+        return dict(cached)
+
+    cap_resp = requests.get(link, timeout=5)
+    cap_resp.raise_for_status()
+    alert = parse_cap_document(link, cap_resp.text)
+    if alert is not None:
+        # only valid documents are cached, empty/invalid ones may be fixed upstream...
+        _cap_cache.set(link, alert)
+        alert = dict(alert)
+    return alert
+
+def get_feed_cache_stats():
+    """Counters of the RSS conditional GETs and of the parsed CAP cache."""
+    return {
+        "rss": dict(_feed_stats),
+        "cap_cache": _cap_cache.stats()
+    }
+
+def fetch_cap_documents(headlines_with_link: dict, limit: int = MAX_ALERTS, deadline: float = CAP_FETCH_DEADLINE):
+    """
+    Fetch CAP documents concurrently and return the first `limit` valid alerts in feed order.
+
+    Args:
+        headlines_with_link (dict): headline -> CAP link, in feed order
+        limit (int): maximum number of alerts to return
+        deadline (float): overall budget in seconds, documents not done by then are dropped
+
+    Returns:
+        list: parsed alerts, ordered as in the feed
+    """
+    items = list(headlines_with_link.items())
+    results = [None] * len(items)
+    settled = [False] * len(items)
+
+    executor = ThreadPoolExecutor(max_workers=CAP_FETCH_WORKERS)
+    futures = {executor.submit(fetch_cap_document, link): index for index, (_, link) in enumerate(items)}
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            index = futures[future]
+            settled[index] = True
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Request failed for {items[index][0]}: {e}")
+
+            # stop as soon as the first `limit` valid alerts (in feed order) are known...
+            valid = 0
+            for is_settled, alert in zip(settled, results):
+                if not is_settled:
+                    break
+                if alert is not None:
+                    valid += 1
+            if valid >= limit:
+                break
+    except FuturesTimeoutError:
+        print(f"CAP fetch deadline of {deadline}s hit, using {sum(settled)} of {len(items)} documents")
+    finally:
+        # drop the downloads that have not started (cancel_futures needs 3.9), running ones just finish
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    return [alert for alert in results if alert is not None][:limit]
+
+def fetch_alerts():
+    """Stream the unique feed headlines and parse the first MAX_ALERTS valid CAP documents."""
+    return fetch_cap_documents(fetch_feed_items())
+
+def _set_snapshot(alerts: list, refreshed_at):
+    index = AlertIndex(alerts)  # built outside the lock, readers keep using the old one meanwhile
+    with _snapshot_lock:
+        _snapshot["alerts"] = alerts
+        _snapshot["refreshed_at"] = refreshed_at
+        _snapshot["index"] = index
+
+def load_stored_snapshot():
+    """Read the last snapshot written by any worker, None if there is none."""
+    try:
+        return mongo.db.alert_snapshots.find_one({"_id": "sachet"})
+    except Exception as e:
+        print(f"Failed to read alert snapshot: {e}")
+        return None
+
+def refresh_alert_snapshot():
+    """
+    Re-fetch the SACHET feed, publish the parsed alerts in memory and Mongo, and record
+    them in the alert history. An empty result (every download failed or the deadline
+    hit) keeps the last good snapshot, it is retried at the next interval.
+    """
+    alerts = fetch_alerts()
+    if not alerts:
+        print("Alert refresh returned no alerts, keeping the previous snapshot")
+        with _snapshot_lock:
+            return _snapshot["alerts"]
+    refreshed_at = datetime.now(timezone.utc)
+    _set_snapshot(alerts, refreshed_at)
+
+    try:
+        mongo.db.alert_snapshots.replace_one(
+            {"_id": "sachet"},
+            {"_id": "sachet", "alerts": alerts, "refreshed_at": refreshed_at},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Failed to store alert snapshot: {e}")
+
+    try:
+        store_alert_history(alerts)
+    except Exception as e:
+        print(f"Failed to store alert history: {e}")
+    return alerts
+
+def get_alert_index():
+    """
+    Return the spatial index of the current alerts, warming the in-memory snapshot
+    from Mongo when this process has not refreshed yet (at most every
+    SNAPSHOT_RELOAD_SECONDS). Empty when no worker has fetched alerts yet.
+    """
+    now = time.monotonic()
+    with _snapshot_lock:
+        index = _snapshot["index"]
+        if index is not None and len(index):
+            return index
+        reloaded_at = _snapshot["reloaded_at"]
+        if reloaded_at is not None and now - reloaded_at < SNAPSHOT_RELOAD_SECONDS:
+            return index if index is not None else AlertIndex([])
+        _snapshot["reloaded_at"] = now
+
+    stored = load_stored_snapshot()
+    if stored and stored.get("alerts"):
+        _set_snapshot(stored["alerts"], stored.get("refreshed_at"))
+    with _snapshot_lock:
+        if _snapshot["index"] is None:
+            _snapshot["index"] = AlertIndex([])
+        return _snapshot["index"]
+
+def _snapshot_is_fresh(refreshed_at):
+    if refreshed_at is None:
+        return False
+    if refreshed_at.tzinfo is None:
+        refreshed_at = refreshed_at.replace(tzinfo=timezone.utc)
+    age = (datetime.now(timezone.utc) - refreshed_at).total_seconds()
+    return age < ALERT_REFRESH_INTERVAL
+
+def _run_worker(app):
+    with app.app_context():
+        while True:
+            try:
+                # another gunicorn worker may have refreshed already, reuse its snapshot...
+                stored = load_stored_snapshot()
+                if stored and stored.get("alerts") and _snapshot_is_fresh(stored.get("refreshed_at")):
+                    _set_snapshot(stored.get("alerts", []), stored.get("refreshed_at"))
+                else:
+                    refresh_alert_snapshot()
+            except Exception as e:
+                print(f"Alert refresh failed: {e}")
+            time.sleep(ALERT_REFRESH_INTERVAL)
+
+def start_alert_worker(app):
+    """Start the background thread that keeps the alert snapshot warm (once per process)."""
+    global _worker
+    if not ALERT_WORKER_ENABLED or _worker is not None:
+        return
+    _worker = threading.Thread(target=_run_worker, args=(app,), name="sachet-alert-worker", daemon=True)
+    _worker.start()
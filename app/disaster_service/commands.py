@@ -0,0 +1,107 @@
+import csv
+import click
+from app.disaster_service import disaster
+from app.disaster_service.utils import migrate_document_types, rescore_request_priorities, archive_resolved_requests
+from app.config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_PAUSE_SECONDS
+from app.info_service.clusters import rebuild_request_clusters
+from app.info_service.search import rebuild_search_terms
+from app.info_service.rollups import rebuild_request_rollups
+from app.disaster_service.importer import import_requests, ImportRowError, IMPORT_BATCH_SIZE
+from app.auth_service.utils import find_user
+
+# run with `flask --app main disaster <command>`...
+
+@disaster.cli.command("migrate-types")
+@click.option("--batch-size", default=1000, show_default=True, help="Documents converted per bulk write")
+def migrate_types(batch_size):
+    """Convert string timestamps to BSON dates and latitude/longitude to GeoJSON, safe to re-run."""
+    def progress(collection, scanned, migrated, seconds):
+        rate = scanned / seconds if seconds else 0.0
+        click.echo(f"  {collection}: {scanned} scanned, {migrated} migrated ({rate:.0f} docs/s)")
+
+    report = migrate_document_types(batch_size, progress)
+    for collection, counts in report.items():
+        rate = counts["scanned"] / counts["seconds"] if counts["seconds"] else 0.0
+        click.echo(f"{collection}: migrated {counts['migrated']} of {counts['scanned']} documents in {counts['seconds']:.1f}s ({rate:.0f} docs/s)")
+    click.echo("Run `flask --app main disaster rebuild-clusters` if requests gained a location")
+
+@disaster.cli.command("rebuild-clusters")
+def rebuild_clusters():
+    """Recompute the map cluster rollups from the open requests."""
+    requests, cells = rebuild_request_clusters()
+    click.echo(f"Rebuilt {cells} cluster cells from {requests} open requests")
+
+@disaster.cli.command("rebuild-rollups")
+def rebuild_rollups():
+    """Recount the dashboard rollups from the live and archived requests (reconcile drift)."""
+    requests, rollups = rebuild_request_rollups()
+    click.echo(f"Rebuilt {rollups} rollups from {requests} requests")
+
+@disaster.cli.command("rebuild-search-terms")
+def rebuild_search_terms_command():
+    """Recount the typo-correction vocabulary of /info/search_requests from the open requests."""
+    requests, words = rebuild_search_terms()
+    click.echo(f"Rebuilt {words} search words from {requests} open requests")
+
+@disaster.cli.command("rescore-priorities")
+def rescore_priorities():
+    """Recompute priority_score of every request (backfill, or after moving PRIORITY_EPOCH)."""
+    updated = rescore_request_priorities()
+    click.echo(f"Rescored {updated} disaster requests")
+
+@disaster.cli.command("archive-requests")
+@click.option("--days", default=ARCHIVE_AFTER_DAYS, show_default=True, help="Archive requests resolved more than this many days ago")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, show_default=True, help="Requests moved per batch")
+@click.option("--pause", default=ARCHIVE_PAUSE_SECONDS, show_default=True, help="Seconds to sleep between batches")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches (run again to resume)")
+def archive_requests(days, batch_size, pause, max_batches):
+    """Move old resolved requests to disaster_requests_archive, safe to interrupt and re-run."""
+    moved, batches, seconds = archive_resolved_requests(
+        days, batch_size, pause, max_batches,
+        progress=lambda moved, batches: click.echo(f"  batch {batches}: {moved} requests moved")
+    )
+    rate = moved / seconds if seconds else 0.0
+    click.echo(f"Archived {moved} requests in {batches} batches ({seconds:.1f}s, {rate:.0f} requests/s)")
+
+@disaster.cli.command("import-requests")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--username", required=True, help="Account (usually the NGO's) the rows are filed under")
+@click.option("--format", "file_format", type=click.Choice(["csv", "geojson"]), default=None, help="Defaults to the file extension")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Rows per insert_many")
+@click.option("--errors", "errors_path", type=click.Path(dir_okay=False, writable=True), default=None, help="Write every rejected row to this CSV")
+def import_survey_requests(path, username, file_format, batch_size, errors_path):
+    """Import disaster requests from a CSV (phone, latitude, longitude, disaster_type, message) or GeoJSON file."""
+    if find_user(username) is None:
+        raise click.BadParameter(f"Invalid username {username}", param_hint="--username")
+    file_format = file_format or ("geojson" if path.lower().endswith((".geojson", ".json", ".geojsonl")) else "csv")
+
+    shown = 0
+    errors_file = open(errors_path, "w", newline="", encoding="utf-8") if errors_path else None
+    errors_writer = csv.writer(errors_file) if errors_file else None
+    if errors_writer:
+        errors_writer.writerow(["row", "error"])
+
+    def on_error(number, message):
+        nonlocal shown
+        if errors_writer:
+            errors_writer.writerow([number, message])
+        if shown < 20:
+            click.echo(f"  row {number}: {message}", err=True)
+        shown += 1
+
+    def progress(rows, inserted, seconds):
+        click.echo(f"  {rows} rows read, {inserted} inserted ({rows / seconds if seconds else 0:.0f} rows/s)")
+
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as stream:
+            counts = import_requests(stream, file_format, username, batch_size, on_error, progress)
+    except ImportRowError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if errors_file:
+            errors_file.close()
+    rate = counts["rows"] / counts["seconds"] if counts["seconds"] else 0.0
+    click.echo(f"Imported {counts['inserted']} of {counts['rows']} rows, {counts['rejected']} rejected "
+               f"in {counts['seconds']:.1f}s ({rate:.0f} rows/s)")
+    if counts["rejected"] > 20 and not errors_path:
+        click.echo("Only the first 20 rejected rows were shown, pass --errors to keep all of them", err=True)
@@ -0,0 +1,206 @@
+import csv
+import json
+import time
+import uuid
+from pymongo.errors import BulkWriteError
+from app.database import mongo
+from app.models import user_disaster_model
+from app.info_service.utils import common_requests_cache
+from app.info_service.clusters import update_request_clusters_many
+from app.info_service.search import update_search_terms_many
+from app.info_service.rollups import update_request_rollups_many
+from app.events import request_events
+
+# Bulk import of survey sheets: rows are parsed one at a time from the file, validated
+# into the user_disaster_model shape and inserted in insert_many(ordered=False) chunks,
+# so memory depends on the chunk size only. Request ids are derived from the row
+# content, importing the same file twice reports the rows as duplicates. Imported requests
+# are marked `source: "import"` and do not count against the account's open request cap.
+
+IMPORT_NAMESPACE = uuid.UUID("0d6f4a1e-8a55-4c1b-b7b8-3f1b8f2f6a21")
+IMPORT_BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 64 * 1024
+REQUIRED_FIELDS = ["phone", "latitude", "longitude", "disaster_type"]
+
+class ImportRowError(ValueError):
+    pass
+
+def iter_csv_rows(stream):
+    """Yield (line number, dict) from a CSV text stream with a header line."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+def iter_geojson_features(stream):
+    """
+    Yield (feature number, feature) from a GeoJSON FeatureCollection (or one feature
+    per line) without loading the document: the text is read in chunks and every
+    feature is decoded with raw_decode as soon as it is complete.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    # a first line holding a whole Feature means GeoJSON Lines, else find the features array...
+    while True:
+        newline = buffer.find("\n")
+        first_line = buffer[:newline] if newline != -1 else (buffer if eof else "")
+        if first_line.strip():
+            try:
+                if json.loads(first_line).get("type") == "Feature":
+                    break
+            except (ValueError, AttributeError):
+                pass
+        start = buffer.find('"features"')
+        bracket = buffer.find("[", start) if start != -1 else -1
+        if bracket != -1:
+            position = bracket + 1
+            break
+        if eof:
+            raise ImportRowError("No GeoJSON features found")
+        fill()
+
+    number = 0
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                return
+            fill()
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            feature, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise ImportRowError(f"Invalid JSON after feature {number}")
+            fill()  # feature split across chunks
+            continue
+        position = end
+        number += 1
+        yield number, feature
+
+def geojson_row(feature: dict) -> dict:
+    """Flatten a Point feature into the same fields as a CSV row."""
+    try:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") != "Point":
+            raise ImportRowError("geometry must be a Point")
+        lon, lat = geometry["coordinates"][:2]
+        return {**(feature.get("properties") or {}), "latitude": lat, "longitude": lon}
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise ImportRowError("feature must be a GeoJSON Point feature")
+
+def request_from_row(row: dict, username: str) -> dict:
+    """Validate a row and build the request document, ImportRowError on bad rows."""
+    row = {key.strip().lower(): value.strip() if isinstance(value, str) else value
+           for key, value in row.items() if key}
+    for field in REQUIRED_FIELDS:
+        if row.get(field) in (None, ""):
+            raise ImportRowError(f"Missing required field: {field}")
+    try:
+        lat, lon = float(row["latitude"]), float(row["longitude"])
+    except (TypeError, ValueError):
+        raise ImportRowError("latitude and longitude must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ImportRowError("latitude/longitude out of range")
+
+    doc = user_disaster_model({
+        "username": username,
+        "phone": str(row["phone"]),
+        "latitude": lat,
+        "longitude": lon,
+        "message": str(row.get("message") or ""),
+        "disaster_type": str(row["disaster_type"])
+    })
+    content = "|".join(str(value) for value in (doc["username"], doc["phone"], lat, lon, doc["disaster_type"], doc["message"]))
+    doc["_id"] = str(uuid.uuid5(IMPORT_NAMESPACE, content))
+    doc["source"] = "import"
+    return doc
+
+def _requests_imported(docs: list):
+    # one rollup write and one cache reset per chunk instead of the per-request hooks
+    update_request_clusters_many([(None, doc) for doc in docs])
+    update_search_terms_many([(None, doc) for doc in docs])
+    update_request_rollups_many([(None, doc) for doc in docs])
+    common_requests_cache.clear()
+    if not request_events.external_source:
+        for doc in docs:
+            request_events.publish("created", doc)
+
+def _insert_batch(batch: list, on_error):
+    """insert_many(ordered=False) a chunk of (row number, doc), returns the inserted count."""
+    docs = [doc for _, doc in batch]
+    try:
+        mongo.db.disaster_requests.insert_many(docs, ordered=False)
+        inserted = docs
+    except BulkWriteError as e:
+        failed = set()
+        for error in e.details.get("writeErrors", []):
+            failed.add(error["index"])
+            number = batch[error["index"]][0]
+            on_error(number, "Duplicate of an imported request" if error.get("code") == 11000 else error.get("errmsg", "Write failed"))
+        inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+    if inserted:
+        _requests_imported(inserted)
+    return len(inserted)
+
+def import_requests(stream, file_format: str, username: str, batch_size: int = IMPORT_BATCH_SIZE, on_error=None, progress=None):
+    """
+    Import survey rows from a CSV or GeoJSON text stream.
+
+    Args:
+        stream: text file object, read incrementally
+        file_format (str): "csv" or "geojson"
+        username (str): account every row is filed under
+        batch_size (int): rows per insert_many
+        on_error (callable): called with (row number, message) for every rejected row
+        progress (callable): called with (rows, inserted, seconds) after each chunk
+
+    Returns:
+        dict: {"rows", "inserted", "rejected", "seconds"}
+    """
+    on_error = on_error or (lambda number, message: None)
+    if file_format == "csv":
+        rows = iter_csv_rows(stream)
+    elif file_format == "geojson":
+        rows = iter_geojson_features(stream)
+    else:
+        raise ValueError("format must be csv or geojson")
+
+    started = time.monotonic()
+    counts = {"rows": 0, "inserted": 0, "rejected": 0}
+
+    def rejected(number, message):
+        counts["rejected"] += 1
+        on_error(number, message)
+
+    batch = []
+    for number, row in rows:
+        counts["rows"] += 1
+        try:
+            if file_format == "geojson":
+                row = geojson_row(row)
+            batch.append((number, request_from_row(row, username)))
+        except ImportRowError as e:
+            rejected(number, str(e))
+        if len(batch) == batch_size:
+            counts["inserted"] += _insert_batch(batch, rejected)
+            batch = []
+            if progress is not None:
+                progress(counts["rows"], counts["inserted"], time.monotonic() - started)
+    if batch:
+        counts["inserted"] += _insert_batch(batch, rejected)
+    counts["seconds"] = time.monotonic() - started
+    return counts
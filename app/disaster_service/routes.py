@@ -1,14 +1,11 @@
 from app.disaster_service import disaster
 from flask import request, jsonify, current_app
-from werkzeug.exceptions import InternalServerError, BadRequest
+from werkzeug.exceptions import HTTPException, InternalServerError, BadRequest
 from app.models import user_disaster_model
-from datetime import datetime, timedelta, timezone
-import requests
-import xml.etree.ElementTree as ET
-from app.disaster_service.utils import find_request, write_request, update_request, add_responders, delete_request, extract_first_coordinate, get_unique_disaster_list, sort_alerts_by_proximity, dump_alerts_to_json, read_alerts_from_json
-from app.auth_service.utils import find_user, update_db
-
-SACHET_FEED_URL = "https://sachet.ndma.gov.in/cap_public_website/rss/rss_india.xml"
+from app.disaster_service.utils import open_request, join_request, resolve_request, retract_request, prioritize_request, find_alert_history, parse_cap_timestamp, find_request, match_request_responders
+from app.config import RESPONDER_MATCH_K, RESPONDER_MATCH_MAX_K, RESPONDER_MAX_DISTANCE_KM
+from app.disaster_service.alerts import get_alert_index, get_feed_cache_stats
+from app.disaster_service.sync import apply_sync_batch
 
 @disaster.route("/get_data", methods=["POST"])
 def get_disasters():
@@ -17,96 +14,73 @@ def get_disasters():
         if not data:
             return jsonify({"error": "No JSON body found"}), 400
         
-        latitude = data["latitude"]
-        longitude = data["longitude"]
-
-        # Fetch the CAP feed
-        response = requests.get(SACHET_FEED_URL, timeout=10)
-        response.raise_for_status()
-        xml_data = response.text
-        
-        if not xml_data.strip():
-            return jsonify({"error": "RSS feed is empty"}), 500
-        
-        try:
-            root = ET.fromstring(xml_data)
-        except ET.ParseError:
-            return jsonify({"error": "Invalid XML in RSS feed"}), 500
-
-        unique_alerts = []
-        temp = {}
-        for item in root.findall("./channel/item"):
-            title_elem = item.find("title")
-            link_elem = item.find("link")
-            if title_elem is None or link_elem is None:
-                continue
-            title = title_elem.text.strip()
-            link = link_elem.text.strip()
-            temp[title] = link
-        
-        unique_headlines_with_link = get_unique_disaster_list(temp)
-
-        count = 0
-        for headline, link in unique_headlines_with_link.items():
-            try:
-                cap_resp = requests.get(link, timeout=5)
-                cap_resp.raise_for_status()
-                if not cap_resp.text.strip():
-                    print(f"Skipping empty CAP XML for {headline}")
-                    continue
-
-                try:
-                    cap_root = ET.fromstring(cap_resp.text)
-                except ET.ParseError:
-                    print(f"Skipping invalid CAP XML at {link}")
-                    continue
-
-                # Namespaces used in CAP XML
-                ns = {"cap": "urn:oasis:names:tc:emergency:cap:1.2"}
-
-                # Extract event, headline, instruction, areaDesc, polygon, timestamp
-                info = cap_root.find("cap:info", ns)
-                if info is None:
-                    continue
-
-                event_elem = info.find("cap:event", ns)
-                event = event_elem.text.strip() if event_elem is not None else ""
-
-                headline_elem = info.find("cap:headline", ns)
-                headline_text = headline_elem.text.strip() if headline_elem is not None else ""
-
-                area_elem = info.find("cap:area/cap:areaDesc", ns)
-                area_desc = area_elem.text.strip() if area_elem is not None else ""
-
-                polygon_elem = info.find("cap:area/cap:polygon", ns)
-                first_coord = extract_first_coordinate(polygon_elem.text if polygon_elem is not None else "")
-
-                timestamp_elem = cap_root.find("cap:sent", ns)
-                timestamp = timestamp_elem.text.strip() if timestamp_elem is not None else ""
-
-                unique_alerts.append({
-                    "title": headline_text,
-                    "link": link,
-                    "event": event,
-                    "timestamp": timestamp,
-                    "areas": area_desc,
-                    "first_coord": first_coord
-                })
-                count = count+1
-                if count == 10:
-                    break
-
-            except requests.RequestException as e:
-                print(f"Request failed for {headline}: {e}")
-                continue
-
-        unique_alerts = sort_alerts_by_proximity(unique_alerts, latitude, longitude)
+        latitude = float(data["latitude"])
+        longitude = float(data["longitude"])
+        limit = int(data["limit"]) if data.get("limit") is not None else None
+        if limit is not None and limit < 0:
+            return jsonify({"error": "limit must not be negative"}), 400
+
+        # served from the snapshot kept warm by the alert worker, no upstream calls here...
+        alert_index = get_alert_index()
+        if not len(alert_index):
+            return jsonify({"error": "Disaster alerts are not available yet, please try again shortly"}), 503
+
+        unique_alerts = alert_index.rank(latitude, longitude, limit)
         return jsonify(unique_alerts), 200
 
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+@disaster.route("/feed_stats", methods=["GET"])
+def feed_stats():
+    try:
+        return jsonify(get_feed_cache_stats()), 200
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch feed cache stats: {e}")
+
+@disaster.route("/alert_history", methods=["GET"])
+def alert_history():
+    try:
+        start = request.args.get("start")
+        end = request.args.get("end")
+        bbox = request.args.get("bbox")  # min_lon,min_lat,max_lon,max_lat
+        event = request.args.get("event")
+        page = int(request.args.get("page", 1))
+        per_page = min(int(request.args.get("per_page", 50)), 200)
+        if page < 1 or per_page < 1:
+            raise BadRequest("page and per_page must be positive")
+
+        start_at = parse_cap_timestamp(start) if start else None
+        end_at = parse_cap_timestamp(end) if end else None
+        if (start and start_at is None) or (end and end_at is None):
+            raise BadRequest("start and end must be ISO 8601 timestamps")
+
+        if bbox:
+            try:
+                bbox = tuple(float(value) for value in bbox.split(","))
+            except ValueError:
+                raise BadRequest("bbox must be min_lon,min_lat,max_lon,max_lat")
+            if len(bbox) != 4:
+                raise BadRequest("bbox must be min_lon,min_lat,max_lon,max_lat")
+            min_lon, min_lat, max_lon, max_lat = bbox
+            if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                raise BadRequest("Invalid bbox")
+
+        alerts, has_more = find_alert_history(start_at, end_at, bbox or None, event, page, per_page)
+        return jsonify({
+            "alerts": alerts,
+            "page": page,
+            "per_page": per_page,
+            "has_more": has_more
+        }), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch alert history: {e}")
+
 @disaster.route("/report_disaster", methods=["POST"])
 def report_disaster():
     try:
@@ -119,21 +93,47 @@ def report_disaster():
             if field not in data or data[field] in [None, ""]:
                 raise BadRequest(f"Missing required field: {field}")
 
-        user = find_user(data["username"])    
-        total_req = user["meta"]["total_requests_made"]
-        active_req = user["meta"]["total_active_requests"]
-        if active_req < 3:
-            disaster_doc = user_disaster_model(data)
-            write_request(disaster_doc)
-            update_db("_id", user["_id"], "meta.total_active_requests", active_req+1)
-            update_db("_id", user["_id"], "meta.total_requests_made", total_req+1)
-            return jsonify({"message": f"The disaster request has been added with id {disaster_doc['_id']}"})
-        else:
+        disaster_doc = user_disaster_model(data)
+        outcome = open_request(data["username"], disaster_doc)
+        if outcome == "created":
+            try:
+                # nearest verified NGO responders, the request is stored even if this fails...
+                matched = match_request_responders(disaster_doc)
+            except Exception as e:
+                print(e)
+                matched = []
+            return jsonify({
+                "message": f"The disaster request has been added with id {disaster_doc['_id']}",
+                "matched_responders": matched
+            })
+        elif outcome == "limit":
             return jsonify({"message": f"User has already three open requests, cancel one to make a new request"}), 429
+        else:
+            return jsonify({"message": f"Invalid username {data['username']}"}), 404
     except Exception as e:
         return InternalServerError(f"Failed to register the disaster request: {e}")
     
 
+@disaster.route("/match_responders/<string:_id>", methods=["GET"]) # nearest verified NGO responders of a request...
+def match_responders(_id):
+    try:
+        k = request.args.get("k", default=RESPONDER_MATCH_K, type=int)
+        if not (0 < k <= RESPONDER_MATCH_MAX_K):
+            raise BadRequest(f"k must be between 1 and {RESPONDER_MATCH_MAX_K}")
+        max_distance = request.args.get("max_distance", default=RESPONDER_MAX_DISTANCE_KM, type=float)  # km
+        if max_distance <= 0:
+            raise BadRequest("max_distance must be positive")
+
+        docs = find_request("_id", _id)
+        if not docs or not docs[0].get("location"):
+            return jsonify({"message": f"Invalid request id: {_id}"}), 404
+        return jsonify({"_id": _id, "responders": match_request_responders(docs[0], k, max_distance)}), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to match responders: {e}")
+
 @disaster.route("/confirm_help", methods=["POST"])
 def confirm_help():
     try:
@@ -144,11 +144,11 @@ def confirm_help():
         _id = data["_id"] # id of the disaster request...
         username = data["username"] # id of the helper...
 
-        user = find_user(username)
-        total_req_served = user["meta"]["total_requests_served"]
-
-        add_responders(_id, [{"username": username, "phone": user["phone"], "email": user["email"]}])
-        update_db("_id", user["_id"], "meta.total_requests_served", total_req_served+1)
+        outcome = join_request(_id, username)
+        if outcome == "no_user":
+            return jsonify({"message": f"Invalid username {username}"}), 404
+        if outcome == "no_request":
+            return jsonify({"message": f"Invalid request id: {_id}"}), 404
 
         return jsonify({"message": f"{username} has been added in the list of responders for {_id} request"}), 200
     except Exception as e:
@@ -162,31 +162,36 @@ def mark_resolved():
             raise BadRequest("Missing JSON body")
         
         _id = data["_id"] # id of the disaster request...
-        user = find_user(data["username"])
-        active_req = user["meta"]["total_active_requests"]
-
-        if active_req == 0:
-            raise BadRequest(f"There is no active requests for this username {data['username']}")
-
-        update_request(_id, ["is_resolved"], [True])
-        update_db("_id", user["_id"], "meta.total_active_requests", active_req-1)
+        if not resolve_request(_id):
+            raise BadRequest(f"There is no active request {_id} for this username {data['username']}")
         return jsonify({"message": f"Request has been marked successful"}), 200
     except Exception as e:
         return InternalServerError(f"Failed to register the disaster request: {e}")
 
+@disaster.route("/sync", methods=["POST"]) # queued offline actions replayed in one call...
+def sync_operations():
+    try:
+        data = request.get_json()
+        if not data:
+            raise BadRequest("Missing JSON body")
+        if not data.get("username"):
+            raise BadRequest("Missing required field: username")
+
+        results = apply_sync_batch(data["username"], data.get("operations"))
+        if results is None:
+            return jsonify({"message": f"Invalid username {data['username']}"}), 404
+        return jsonify({"results": results}), 200
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to apply the sync batch: {e}")
+
 @disaster.route("/priortize/<string:_id>", methods=["GET"])
 def priortize_request(_id):
     try:
-        req = find_request("_id", _id)
-        if req[0]:
-            created_at = datetime.fromisoformat(req[0]["created_at"]).replace(tzinfo=timezone.utc)
-            now = datetime.now(timezone.utc)
-            time_diff = now - created_at
-            if time_diff > timedelta(hours=0): ###
-                update_request(req[0]["_id"], ["priority_count", "updated_at"], [req[0]["priority_count"] + 1, datetime.utcnow().isoformat()])
-                return jsonify({"message": f"Your request has been prioritized"}), 200
-            else:
-                return jsonify({"message": f"Wait for 5 hrs before making another request"}), 200 # 5hrs
+        if prioritize_request(_id):
+            return jsonify({"message": f"Your request has been prioritized"}), 200
         else:
             return jsonify({"message": f"invalid request id {_id}"}), 400
     except Exception as e:
@@ -196,17 +201,9 @@ def priortize_request(_id):
 @disaster.route("/cancel_request/<string:_id>", methods=["GET"])
 def cancel_request(_id):
     try:
-        req = find_request("_id", _id)
-        user = find_user(req[0]["username"])
-        active_req = user["meta"]["total_active_requests"]
-
-        if not req:
-            return jsonify({"message": f"Invalid request id: {_id}"}), 404
-
-        if delete_request(req[0]["_id"]) == 1:
-            update_db("_id", user["_id"], "meta.total_active_requests", active_req-1)
+        if retract_request(_id):
             return jsonify({"message": "Request has been cancelled."}), 200
         else:
-            return jsonify({"message": f"invalid request id {_id}"}), 400
+            return jsonify({"message": f"Invalid request id: {_id}"}), 404
     except Exception as e:
         return InternalServerError(f"Failed to register the disaster request: {e}")
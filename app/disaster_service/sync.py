@@ -0,0 +1,352 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pymongo import InsertOne, UpdateOne, DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+from werkzeug.exceptions import HTTPException, BadRequest, InternalServerError
+from app.database import mongo, run_in_transaction
+from app.models import user_disaster_model
+from app.priority import priority_bump, priority_bump_expression, add_priority
+from app.disaster_service.utils import _request_changed, _holds_slot
+from app.config import MAX_ACTIVE_REQUESTS, SYNC_MAX_OPERATIONS
+
+# Offline sync: a field app replays its queued actions as one ordered batch.
+#   {"username": "...", "operations": [{"key": "<client uuid>", "op": "report", "data": {...}}, ...]}
+# Every operation is planned in order against the state read up front, then all writes
+# go out as one bulk_write per collection inside a transaction. Without transactions the
+# operations are written one by one, each checked and recorded on its own, so a batch that
+# fails halfway keeps a ledger entry for everything it applied. Results are stored under
+# (username, key) in sync_operations so a replayed batch answers from there instead of
+# writing again, and a report's request _id is derived from its key so it can never be
+# inserted twice.
+
+SYNC_OPERATIONS = {"report", "prioritize", "confirm_help", "resolve", "cancel"}
+SYNC_NAMESPACE = uuid.UUID("5f0b9a52-3c1e-4d39-9a6f-1b2f2f7c9e10")
+CONFLICT_RETRIES = 3
+
+class _CounterConflict(Exception):
+    """The user's counters changed between planning and writing, plan again."""
+
+def sync_request_id(username: str, key: str) -> str:
+    """_id of the request created by the `report` operation with idempotency key `key`."""
+    return str(uuid.uuid5(SYNC_NAMESPACE, f"{username}:{key}"))
+
+def validate_sync_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise BadRequest("operations must be a non-empty list")
+    if len(operations) > SYNC_MAX_OPERATIONS:
+        raise BadRequest(f"At most {SYNC_MAX_OPERATIONS} operations per batch")
+    keys = set()
+    for position, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BadRequest(f"Operation {position} must be an object")
+        key = operation.get("key")
+        if not isinstance(key, str) or not key or len(key) > 128:
+            raise BadRequest(f"Operation {position} needs a string idempotency key")
+        if key in keys:
+            raise BadRequest(f"Duplicate idempotency key {key}")
+        keys.add(key)
+        if operation.get("op") not in SYNC_OPERATIONS:
+            raise BadRequest(f"Operation {position} has an unknown op, expected one of {sorted(SYNC_OPERATIONS)}")
+        if not isinstance(operation.get("data", {}), dict):
+            raise BadRequest(f"Operation {position} data must be an object")
+
+def _result(operation: dict, status: int, message: str, request_id: str = None):
+    return {"key": operation["key"], "op": operation["op"], "status": status, "message": message, "_id": request_id}
+
+def _target_id(username: str, data: dict):
+    # an operation may point at a request reported earlier in the same (or an older) batch by its key
+    if data.get("request_key"):
+        return sync_request_id(username, str(data["request_key"]))
+    return data.get("_id")
+
+class _SyncStep:
+    """The writes of one planned operation, applied (or undone) together."""
+
+    def __init__(self, position: int, filter: dict = None, update=None, insert: dict = None, tombstone: dict = None,
+                 counters: dict = None, change: tuple = None):
+        self.position = position  # index of its result in the plan
+        self.filter = filter      # request to update (with `update`) or delete (without)
+        self.update = update
+        self.insert = insert      # new request document
+        self.tombstone = tombstone
+        self.counters = counters or {}
+        self.change = change  # (kind, before, after, event) for the hooks after commit
+
+    def request_write(self):
+        if self.insert is not None:
+            return InsertOne(self.insert)
+        if self.update is not None:
+            return UpdateOne(self.filter, self.update)
+        return DeleteOne(self.filter)
+
+class _SyncPlan:
+    """Outcome of every operation and the writes that carry them out."""
+
+    def __init__(self):
+        self.results = []
+        self.steps = []
+        self.ledger = []  # (position, ledger document)
+        self.counters = defaultdict(int)
+
+    def add(self, step: _SyncStep):
+        self.steps.append(step)
+        for field, delta in step.counters.items():
+            self.counters[field] += delta
+
+    @property
+    def changes(self):
+        return [step.change for step in self.steps if step.change is not None]
+
+def _plan(username: str, user: dict, operations: list, done: dict, requests: dict, now: datetime):
+    plan = _SyncPlan()
+    active = user["meta"]["total_active_requests"]
+    bump = priority_bump(now)
+
+    for operation in operations:
+        ledger_id = f"{username}:{operation['key']}"
+        if ledger_id in done:
+            plan.results.append({**done[ledger_id], "replayed": True})
+            continue
+
+        kind = operation["op"]
+        data = operation.get("data") or {}
+        if kind == "report":
+            request_id = sync_request_id(username, operation["key"])
+            missing = [field for field in ("latitude", "longitude", "disaster_type") if data.get(field) in (None, "")]
+            if request_id in requests:
+                result = _result(operation, 200, "Already reported", request_id)
+            elif missing:
+                result = _result(operation, 400, f"Missing required field: {missing[0]}")
+            elif active >= MAX_ACTIVE_REQUESTS:
+                result = _result(operation, 429, "User has already three open requests, cancel one to make a new request")
+            else:
+                try:
+                    doc = user_disaster_model({**data, "username": username, "phone": data.get("phone") or user.get("phone")})
+                except (TypeError, ValueError):
+                    doc = None
+                if doc is None:
+                    result = _result(operation, 400, "Invalid latitude/longitude")
+                else:
+                    doc["_id"] = request_id
+                    plan.add(_SyncStep(
+                        len(plan.results), insert=doc,
+                        counters={"meta.total_active_requests": 1, "meta.total_requests_made": 1},
+                        change=("created", None, doc, None)
+                    ))
+                    requests[request_id] = doc
+                    active += 1
+                    result = _result(operation, 201, "The disaster request has been added", request_id)
+        else:
+            request_id = _target_id(username, data)
+            before = requests.get(request_id) if request_id else None
+            if before is None:
+                result = _result(operation, 404, f"Invalid request id: {request_id}", request_id)
+            elif kind == "prioritize":
+                after = {
+                    **before,
+                    "priority_count": (before.get("priority_count") or 0) + 1,
+                    "priority_score": add_priority(before.get("priority_score"), before.get("priority_weight"), bump),
+                    "priority_updated_at": now,
+                    "updated_at": now
+                }
+                plan.add(_SyncStep(len(plan.results), {"_id": request_id}, [{"$set": {
+                    "priority_count": {"$add": [{"$ifNull": ["$priority_count", 0]}, 1]},
+                    "priority_score": priority_bump_expression(bump),
+                    "priority_updated_at": now,
+                    "updated_at": now
+                }}], change=("prioritized", before, after, None)))
+                requests[request_id] = after
+                result = _result(operation, 200, "Your request has been prioritized", request_id)
+            elif kind == "confirm_help":
+                responder = {"username": username, "phone": user.get("phone"), "email": user.get("email")}
+                after = {**before, "active_responders": [*(before.get("active_responders") or []), responder], "updated_at": now}
+                plan.add(_SyncStep(
+                    len(plan.results),
+                    {"_id": request_id}, {"$push": {"active_responders": responder}, "$set": {"updated_at": now}},
+                    counters={"meta.total_requests_served": 1},
+                    change=("helped", before, after, None)
+                ))
+                requests[request_id] = after
+                result = _result(operation, 200, f"{username} has been added in the list of responders", request_id)
+            elif before.get("username") != username:
+                result = _result(operation, 403, "Only the owner can resolve or cancel a request", request_id)
+            elif kind == "resolve":
+                if before.get("is_resolved"):
+                    result = _result(operation, 400, "Request is already resolved", request_id)
+                else:
+                    after = {**before, "is_resolved": True, "updated_at": now}
+                    releases = _holds_slot(before) and active > 0
+                    plan.add(_SyncStep(
+                        len(plan.results),
+                        {"_id": request_id, "is_resolved": False}, {"$set": {"is_resolved": True, "updated_at": now}},
+                        counters={"meta.total_active_requests": -1} if releases else {},
+                        change=("resolved", before, after, None)
+                    ))
+                    requests[request_id] = after
+                    if releases:
+                        active -= 1
+                    result = _result(operation, 200, "Request has been marked successful", request_id)
+            else:  # cancel
+                tombstone = {"_id": request_id, "username": username, "location": before.get("location"), "updated_at": now}
+                releases = _holds_slot(before) and active > 0
+                plan.add(_SyncStep(
+                    len(plan.results), {"_id": request_id}, tombstone=tombstone,
+                    counters={"meta.total_active_requests": -1} if releases else {},
+                    change=("cancelled", before, None, tombstone)
+                ))
+                if releases:
+                    active -= 1
+                del requests[request_id]
+                result = _result(operation, 200, "Request has been cancelled.", request_id)
+
+        plan.ledger.append((len(plan.results), {
+            "_id": ledger_id,
+            "username": username,
+            "result": result,
+            "created_at": now
+        }))
+        plan.results.append(result)
+    return plan
+
+def _missed(step: _SyncStep) -> dict:
+    # result of an operation whose request changed between planning and writing
+    kind, before = step.change[0], step.change[1]
+    if kind == "resolved":
+        return {"status": 400, "message": "Request is no longer open"}
+    return {"status": 404, "message": f"Invalid request id: {before['_id']}"}
+
+def _write_steps(plan: _SyncPlan, session):
+    """All writes in one ordered bulk_write per collection, inside the transaction."""
+    request_writes = [step.request_write() for step in plan.steps]
+    tombstone_writes = [ReplaceOne({"_id": step.tombstone["_id"]}, step.tombstone, upsert=True)
+                        for step in plan.steps if step.tombstone is not None]
+    if request_writes:
+        written = mongo.db.disaster_requests.bulk_write(request_writes, ordered=True, session=session)
+        updates = sum(step.update is not None for step in plan.steps)
+        deletes = sum(step.insert is None and step.update is None for step in plan.steps)
+        if written.matched_count != updates or written.deleted_count != deletes:
+            raise _CounterConflict()  # a request changed after it was read, abort and plan again
+    if tombstone_writes:
+        mongo.db.request_tombstones.bulk_write(tombstone_writes, ordered=False, session=session)
+
+def _apply_step(step: _SyncStep) -> bool:
+    """Write one operation without a transaction, False (and nothing written) when its request changed meanwhile."""
+    if step.insert is not None:
+        mongo.db.disaster_requests.insert_one(step.insert)
+        return True
+    if step.update is not None:
+        return mongo.db.disaster_requests.update_one(step.filter, step.update).matched_count == 1
+    deleted = mongo.db.disaster_requests.find_one_and_delete(step.filter)
+    if deleted is None:
+        return False
+    try:
+        mongo.db.request_tombstones.replace_one({"_id": step.tombstone["_id"]}, step.tombstone, upsert=True)
+    except Exception:
+        mongo.db.disaster_requests.insert_one(deleted)
+        raise
+    return True
+
+def _apply_steps(plan: _SyncPlan, user: dict):
+    """
+    Write the operations one by one without a transaction. Counters of operations that
+    were not applied are given back and every applied operation keeps its ledger entry,
+    also when a write fails halfway, so a retried batch never applies one twice.
+    """
+    pending = list(plan.steps)
+    recorded = set(range(len(plan.results)))  # positions whose ledger entry is written
+    giveback = defaultdict(int)
+    try:
+        while pending:
+            step = pending[0]
+            if not _apply_step(step):
+                result = plan.results[step.position]
+                result.update(_missed(step))
+                step.change = None
+                for field, delta in step.counters.items():
+                    giveback[field] -= delta
+            pending.pop(0)
+    except Exception:
+        for step in pending:
+            recorded.discard(step.position)
+            for field, delta in step.counters.items():
+                giveback[field] -= delta
+        raise
+    finally:
+        giveback = {field: delta for field, delta in giveback.items() if delta}
+        if giveback:
+            mongo.db.users.update_one({"_id": user["_id"]}, {"$inc": giveback})
+        _record(plan, recorded, None)
+
+def _record(plan: _SyncPlan, positions, session):
+    writes = [InsertOne(doc) for position, doc in plan.ledger if position in positions]
+    if not writes:
+        return
+    try:
+        mongo.db.sync_operations.bulk_write(writes, ordered=False, session=session)
+    except BulkWriteError as e:
+        # a concurrent replay of the same batch recorded them first
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def _execute(username: str, operations: list, session):
+    now = datetime.now(timezone.utc)
+    user = mongo.db.users.find_one({"username": username}, {"meta": 1, "phone": 1, "email": 1}, session=session)
+    if user is None:
+        return None
+
+    ledger_ids = [f"{username}:{operation['key']}" for operation in operations]
+    done = {doc["_id"]: doc["result"] for doc in mongo.db.sync_operations.find({"_id": {"$in": ledger_ids}}, session=session)}
+
+    request_ids = set()
+    for operation in operations:
+        data = operation.get("data") or {}
+        request_ids.add(sync_request_id(username, operation["key"]) if operation["op"] == "report" else _target_id(username, data))
+    request_ids.discard(None)
+    requests = {doc["_id"]: doc for doc in mongo.db.disaster_requests.find({"_id": {"$in": list(request_ids)}}, session=session)}
+
+    plan = _plan(username, user, operations, done, requests, now)
+
+    counters = {field: delta for field, delta in plan.counters.items() if delta}
+    if counters:
+        # compare-and-set on the counter the plan was made from, a concurrent write makes us re-plan
+        updated = mongo.db.users.update_one(
+            {"_id": user["_id"], "meta.total_active_requests": user["meta"]["total_active_requests"]},
+            {"$inc": counters},
+            session=session
+        )
+        if updated.matched_count == 0:
+            raise _CounterConflict()
+    if session is None:
+        _apply_steps(plan, user)
+    else:
+        _write_steps(plan, session)
+        _record(plan, range(len(plan.results)), session)
+    return plan
+
+def apply_sync_batch(username: str, operations: list):
+    """
+    Apply a batch of queued operations in order.
+
+    Returns:
+        list: one result per operation ({"key", "op", "status", "message", "_id"}, plus
+        "replayed": True when it was already applied), None when the user does not exist
+    """
+    validate_sync_operations(operations)
+    for attempt in range(CONFLICT_RETRIES):
+        try:
+            plan = run_in_transaction(lambda session: _execute(username, operations, session))
+            break
+        except _CounterConflict:
+            if attempt == CONFLICT_RETRIES - 1:
+                raise InternalServerError(description="Too many concurrent updates, retry the batch")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise InternalServerError(description=f"Failed to apply the sync batch: {e}")
+    if plan is None:
+        return None
+
+    for kind, before, after, event in plan.changes:
+        _request_changed(kind, before, after, event=event)
+    return plan.results
@@ -1,10 +1,25 @@
 from werkzeug.exceptions import InternalServerError
-from app.database import mongo
+from app.database import mongo, run_in_transaction
 from typing import List
-from rapidfuzz import fuzz
-from math import radians, cos, sin, asin, sqrt
+from rapidfuzz import fuzz, process
+import numpy as np
+from datetime import datetime, timezone, timedelta
+from pymongo import UpdateOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from shapely.geometry import mapping, shape
+from shapely.geometry.polygon import orient
+from shapely.geometry.base import BaseMultipartGeometry
+from app.disaster_service.alert_index import alert_geometry
+from app.info_service.utils import common_requests_cache
+from app.info_service.clusters import update_request_clusters
+from app.info_service.search import update_search_terms
+from app.info_service.rollups import update_request_rollups
+from app.events import request_events
+from app.priority import priority_weight, priority_bump, priority_bump_expression, estimate_priority_score
 import os
 import json
+import time
+from app.config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_PAUSE_SECONDS, MAX_ACTIVE_REQUESTS, RESPONDER_MATCH_K, RESPONDER_MAX_DISTANCE_KM
 
 def find_request(key_name: str, value: str):
     try:
@@ -13,41 +28,457 @@ def find_request(key_name: str, value: str):
     except Exception as e:
         raise InternalServerError(description = f"Request search failed: {e}")
     
-def write_request(disaster_doc: dict):
+def _request_changed(kind: str, before: dict, after: dict, event: dict = None):
+    """
+    Side effects of any write on a request. `before`/`after` are the request around
+    the write (None when it did not / no longer exists), `event` the published payload
+    (defaults to `after`).
+    """
+    doc = after or before
+    location = (doc or {}).get("location")
+    if location:
+        lon, lat = location["coordinates"]
+        common_requests_cache.invalidate(lat, lon)
     try:
-        mongo.db.disaster_requests.insert_one(disaster_doc)
+        update_request_clusters(before, after)
     except Exception as e:
-        raise InternalServerError(description = f"Database write failed: {e}")
-    
-def update_request(id: str, keys: List[str], values):
+        # the request itself is written, `flask disaster rebuild-clusters` repairs the rollups
+        print(f"Failed to update request clusters: {e}")
     try:
-        for index, key_name in enumerate(keys):
-            mongo.db.disaster_requests.update_one(
-                {"_id": id},
-                {"$set": {key_name: values[index]}}
-            )
+        update_request_rollups(before, after)
     except Exception as e:
-        raise InternalServerError(description=f"Update failed: {e}")
-    
-def add_responders(id: str, values):
+        # `flask disaster rebuild-rollups` recounts them
+        print(f"Failed to update request rollups: {e}")
     try:
-        # If values is a list with a single item, push just that item
-        # Otherwise push values directly
-        push_value = values[0] if isinstance(values, list) and len(values) == 1 else values
-        mongo.db.disaster_requests.update_one(
+        update_search_terms(before, after)
+    except Exception as e:
+        # only typo correction reads it, `flask disaster rebuild-search-terms` repairs it
+        print(f"Failed to update search terms: {e}")
+    # with a change stream running every worker hears about the write from Mongo instead...
+    event = event or after
+    if event is not None and not request_events.external_source:
+        request_events.publish(kind, event)
+
+def prioritize_request(id: str):
+    """
+    Bump a request in one atomic server-side update: priority_count + 1 and the
+    decayed bump (times the request's type weight) added to priority_score in log space, so
+    concurrent calls never overwrite each other. Returns False for unknown ids.
+    """
+    now = datetime.now(timezone.utc)
+    bump = priority_bump(now)
+    try:
+        doc = mongo.db.disaster_requests.find_one_and_update(
             {"_id": id},
-            {"$push": {"active_responders": push_value}}
+            [{"$set": {
+                "priority_count": {"$add": [{"$ifNull": ["$priority_count", 0]}, 1]},
+                "priority_score": priority_bump_expression(bump),
+                "priority_updated_at": now,
+                "updated_at": now
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        raise InternalServerError(description=f"Failed to prioritize the request: {e}")
+    if doc is None:
+        return False
+    _request_changed("prioritized", {**doc, "priority_count": doc["priority_count"] - 1}, doc)
+    return True
+
+def rescore_request_priorities(batch_size: int = 1000):
+    """Set priority_weight/priority_score from the stored fields on every request, returns the count."""
+    try:
+        cursor = mongo.db.disaster_requests.find(
+            {}, {"disaster_type": 1, "created_at": 1, "priority_count": 1, "priority_updated_at": 1}
+        ).batch_size(batch_size)
+        updated = 0
+        operations = []
+        for doc in cursor:
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "priority_weight": priority_weight(doc.get("disaster_type")),
+                "priority_score": estimate_priority_score(doc)
+            }}))
+            if len(operations) == batch_size:
+                updated += mongo.db.disaster_requests.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += mongo.db.disaster_requests.bulk_write(operations, ordered=False).modified_count
+        return updated
+    except Exception as e:
+        raise InternalServerError(description=f"Failed to rescore request priorities: {e}")
+
+def _tombstone(deleted: dict, session=None):
+    # tombstone so delta-sync clients learn about the cancellation...
+    tombstone = {
+        "_id": deleted["_id"],
+        "username": deleted.get("username"),
+        "location": deleted.get("location"),
+        "updated_at": datetime.now(timezone.utc)
+    }
+    mongo.db.request_tombstones.replace_one({"_id": deleted["_id"]}, tombstone, upsert=True, session=session)
+    return tombstone
+
+# Request lifecycle: the request write and the user counters change together, in one
+# transaction on replica sets. Counters only move by conditional $inc, so concurrent
+# calls can't lose updates or push a user past MAX_ACTIVE_REQUESTS. Without
+# transactions a failed second step undoes the first one instead.
+
+class _Abort(Exception):
+    """Raised inside a lifecycle callback to roll the transaction back."""
+
+def _holds_slot(doc: dict) -> bool:
+    # open requests count against their owner's cap, imported ones never took a slot
+    return not doc.get("is_resolved") and doc.get("source") != "import"
+
+def _release_active_request(username: str, session=None):
+    mongo.db.users.update_one(
+        {"username": username, "meta.total_active_requests": {"$gt": 0}},
+        {"$inc": {"meta.total_active_requests": -1}},
+        session=session
+    )
+
+def open_request(username: str, disaster_doc: dict, max_active: int = MAX_ACTIVE_REQUESTS):
+    """
+    Store a new request of `username` if they have fewer than `max_active` open ones.
+
+    Returns:
+        str: "created", "limit" (already at the cap) or "no_user"
+    """
+    disaster_doc.setdefault("updated_at", datetime.now(timezone.utc))
+
+    def create(session):
+        user = mongo.db.users.find_one_and_update(
+            {"username": username, "meta.total_active_requests": {"$lt": max_active}},
+            {"$inc": {"meta.total_active_requests": 1, "meta.total_requests_made": 1}},
+            projection={"_id": 1},
+            session=session
         )
+        if user is None:
+            return "no_user" if mongo.db.users.find_one({"username": username}, {"_id": 1}, session=session) is None else "limit"
+        try:
+            mongo.db.disaster_requests.insert_one(disaster_doc, session=session)
+        except Exception:
+            if session is None:
+                mongo.db.users.update_one(
+                    {"_id": user["_id"]},
+                    {"$inc": {"meta.total_active_requests": -1, "meta.total_requests_made": -1}}
+                )
+            raise
+        return "created"
+
+    try:
+        outcome = run_in_transaction(create)
+    except Exception as e:
+        raise InternalServerError(description=f"Database write failed: {e}")
+    if outcome == "created":
+        _request_changed("created", None, disaster_doc)
+    return outcome
+
+def join_request(id: str, username: str):
+    """
+    Add `username` to the responders of request `id` and count it as served.
+
+    Returns:
+        str: "joined", "no_user" or "no_request"
+    """
+    def join(session):
+        helper = mongo.db.users.find_one_and_update(
+            {"username": username},
+            {"$inc": {"meta.total_requests_served": 1}},
+            projection={"phone": 1, "email": 1},
+            session=session
+        )
+        if helper is None:
+            return "no_user", None
+        doc = mongo.db.disaster_requests.find_one_and_update(
+            {"_id": id},
+            {
+                "$push": {"active_responders": {"username": username, "phone": helper.get("phone"), "email": helper.get("email")}},
+                "$set": {"updated_at": datetime.now(timezone.utc)}
+            },
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        if doc is None:
+            if session is None:
+                mongo.db.users.update_one({"_id": helper["_id"]}, {"$inc": {"meta.total_requests_served": -1}})
+                return "no_request", None
+            raise _Abort()
+        return "joined", doc
+
+    try:
+        outcome, doc = run_in_transaction(join)
+    except _Abort:
+        return "no_request"
     except Exception as e:
         raise InternalServerError(description=f"Failed to add active responder: {e}")
-    
-def delete_request(id: str):
+    if doc is not None:
+        _request_changed("helped", {**doc, "active_responders": doc["active_responders"][:-1]}, doc)
+    return outcome
+
+def resolve_request(id: str):
+    """Mark an open request resolved and free a slot of its owner, False if it is not open."""
+    def resolve(session):
+        before = mongo.db.disaster_requests.find_one_and_update(
+            {"_id": id, "is_resolved": False},
+            {"$set": {"is_resolved": True, "updated_at": datetime.now(timezone.utc)}},
+            session=session
+        )
+        if before is None or not _holds_slot(before):
+            return before
+        try:
+            _release_active_request(before["username"], session)
+        except Exception:
+            if session is None:
+                mongo.db.disaster_requests.update_one(
+                    {"_id": id, "is_resolved": True},
+                    {"$set": {"is_resolved": False, "updated_at": before.get("updated_at") or datetime.now(timezone.utc)}}
+                )
+            raise
+        return before
+
     try:
-        result = mongo.db.disaster_requests.delete_one({"_id": id})
-        return result.deleted_count
+        before = run_in_transaction(resolve)
     except Exception as e:
-         raise InternalServerError(description=f"Failed to delete the request: {e}")
-    
+        raise InternalServerError(description=f"Update failed: {e}")
+    if before is None:
+        return False
+    _request_changed("resolved", before, {**before, "is_resolved": True})
+    return True
+
+def retract_request(id: str):
+    """Delete a request (tombstoned), freeing a slot of its owner when it was still open. False if unknown."""
+    def cancel(session):
+        deleted = mongo.db.disaster_requests.find_one_and_delete({"_id": id}, session=session)
+        if deleted is None:
+            return None, None
+        try:
+            tombstone = _tombstone(deleted, session)
+            if _holds_slot(deleted):
+                _release_active_request(deleted["username"], session)
+        except Exception:
+            if session is None:
+                mongo.db.disaster_requests.insert_one(deleted)
+                mongo.db.request_tombstones.delete_one({"_id": id})
+            raise
+        return deleted, tombstone
+
+    try:
+        deleted, tombstone = run_in_transaction(cancel)
+    except Exception as e:
+        raise InternalServerError(description=f"Failed to delete the request: {e}")
+    if deleted is None:
+        return False
+    _request_changed("cancelled", deleted, None, event=tombstone)
+    return True
+
+def find_nearest_responders(lat: float, lon: float, k: int = RESPONDER_MATCH_K, exclude: List[str] = (),
+                            max_distance: float = RESPONDER_MAX_DISTANCE_KM):
+    """
+    The `k` active verified NGO responders nearest to a point, ranked by MongoDB with
+    $geoNear on the users 2dsphere `location` index (only the k nearest are read).
+
+    Args:
+        lat, lon (float): where help is needed
+        k (int): number of responders
+        exclude (list): usernames to leave out (requester, responders already helping)
+        max_distance (float): only responders within this many km, None for any distance
+
+    Returns:
+        list: [{"username", "name", "phone", "email", "distance"}], distance in km, nearest first
+    """
+    try:
+        query = {"is_verified_ngo": True, "is_active": True}
+        if exclude:
+            query["username"] = {"$nin": list(exclude)}
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "key": "location",
+            "distanceField": "distance",
+            "distanceMultiplier": 0.001,  # meters -> km
+            "query": query,
+            "spherical": True
+        }
+        if max_distance is not None:
+            geo_near["maxDistance"] = float(max_distance) * 1000
+        return list(mongo.db.users.aggregate([
+            {"$geoNear": geo_near},
+            {"$limit": int(k)},
+            {"$project": {"_id": 0, "username": 1, "name": 1, "phone": 1, "email": 1, "distance": 1}}
+        ]))
+    except Exception as e:
+        raise InternalServerError(description=f"Responder search failed: {e}")
+
+def match_request_responders(doc: dict, k: int = RESPONDER_MATCH_K, max_distance: float = RESPONDER_MAX_DISTANCE_KM):
+    """`find_nearest_responders` for a request, leaving out its owner and current responders."""
+    lon, lat = doc["location"]["coordinates"]
+    exclude = [doc.get("username")] + [responder.get("username") for responder in doc.get("active_responders") or []
+                                       if isinstance(responder, dict)]
+    return find_nearest_responders(lat, lon, k, [name for name in exclude if name], max_distance)
+
+# collection -> (timestamp fields once stored as ISO strings, has latitude/longitude floats)
+TYPE_MIGRATIONS = {
+    "disaster_requests": (["created_at", "priority_updated_at"], True),
+    "disaster_requests_archive": (["created_at", "priority_updated_at"], True),
+    "users": (["registered_at", "last_login"], False),
+}
+
+def _stored_timestamp(value):
+    """Datetime of a timestamp stored as an ISO string (naive ones are UTC), None if unparseable."""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+def _migration_update(doc: dict, fields: List[str], coordinates: bool):
+    updates = {}
+    for field in fields:
+        if isinstance(doc.get(field), str):
+            parsed = _stored_timestamp(doc[field])
+            if parsed is not None:
+                updates[field] = parsed
+    unset = {}
+    if coordinates and "latitude" in doc:
+        lat, lon = doc.get("latitude"), doc.get("longitude")
+        if doc.get("location") is None and isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            updates["location"] = {"type": "Point", "coordinates": [float(lon), float(lat)]}
+        if doc.get("location") is not None or "location" in updates:
+            unset = {"latitude": "", "longitude": ""}
+    update = {}
+    if updates:
+        update["$set"] = updates
+    if unset:
+        update["$unset"] = unset
+    return update
+
+def migrate_document_types(batch_size: int = 1000, progress=None):
+    """
+    Convert ISO string timestamps to BSON datetimes and latitude/longitude floats to
+    the GeoJSON `location`, in place and in `_id` order batches of one bulk_write.
+    Users get a GeoJSON `location` copied from `last_active_location`, alert history
+    areas their `area_bbox`.
+
+    Only documents still holding old types are read, so an interrupted run just starts
+    again where it stopped. Values that cannot be parsed are left as they are.
+
+    Args:
+        batch_size (int): documents per batch
+        progress (callable): called with (collection, scanned, migrated, seconds) after each batch
+
+    Returns:
+        dict: collection -> {"scanned", "migrated", "seconds"}
+    """
+    report = {}
+    try:
+        for collection_name, (fields, coordinates) in TYPE_MIGRATIONS.items():
+            collection = mongo.db[collection_name]
+            pending = [{field: {"$type": "string"}} for field in fields]
+            if coordinates:
+                pending.append({"latitude": {"$exists": True}})
+            projection = {field: 1 for field in fields}
+            if coordinates:
+                projection.update({"latitude": 1, "longitude": 1, "location": 1})
+
+            started = time.monotonic()
+            scanned = migrated = 0
+            last_id = None
+            while True:
+                query = {"$or": pending}
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                docs = list(collection.find(query, projection).sort("_id", 1).limit(batch_size))
+                if not docs:
+                    break
+                last_id = docs[-1]["_id"]
+                scanned += len(docs)
+                operations = []
+                for doc in docs:
+                    update = _migration_update(doc, fields, coordinates)
+                    if update:
+                        operations.append(UpdateOne({"_id": doc["_id"]}, update))
+                if operations:
+                    migrated += collection.bulk_write(operations, ordered=False).modified_count
+                if progress is not None:
+                    progress(collection_name, scanned, migrated, time.monotonic() - started)
+            report[collection_name] = {"scanned": scanned, "migrated": migrated, "seconds": time.monotonic() - started}
+
+        # users: GeoJSON `location` for responder matching from last_active_location, one server-side update
+        started = time.monotonic()
+        result = mongo.db.users.update_many(
+            {
+                "location": None,
+                "last_active_location.lat": {"$type": "number", "$gte": -90, "$lte": 90},
+                "last_active_location.lon": {"$type": "number", "$gte": -180, "$lte": 180}
+            },
+            [{"$set": {"location": {"type": "Point", "coordinates": ["$last_active_location.lon", "$last_active_location.lat"]}}}]
+        )
+        report["users.location"] = {"scanned": result.matched_count, "migrated": result.modified_count, "seconds": time.monotonic() - started}
+
+        # alert history: bounds of the area for the bbox filter
+        started = time.monotonic()
+        scanned = migrated = 0
+        operations = []
+        for doc in mongo.db.alert_history.find({"area": {"$exists": True}, "area_bbox": {"$exists": False}}, {"area": 1}).batch_size(batch_size):
+            scanned += 1
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"area_bbox": area_bbox(doc["area"])}}))
+            if len(operations) == batch_size:
+                migrated += mongo.db.alert_history.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            migrated += mongo.db.alert_history.bulk_write(operations, ordered=False).modified_count
+        report["alert_history.area_bbox"] = {"scanned": scanned, "migrated": migrated, "seconds": time.monotonic() - started}
+        return report
+    except Exception as e:
+        raise InternalServerError(description=f"Failed to migrate document types: {e}")
+
+def archive_resolved_requests(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                              pause: float = ARCHIVE_PAUSE_SECONDS, max_batches: int = None, progress=None):
+    """
+    Move requests resolved more than `older_than_days` ago to disaster_requests_archive.
+
+    Each batch is upserted into the archive, then deleted from the live collection,
+    so a run stopped at any point can simply be started again: whatever still matches
+    is moved next time and a copy left in both tiers is overwritten, not duplicated.
+
+    Args:
+        older_than_days (int): age of the last write (the resolution) before archiving
+        batch_size (int): requests moved per bulk_write
+        pause (float): seconds to sleep between batches
+        max_batches (int): stop after this many batches, None to drain
+        progress (callable): called with (moved, batches) after each batch
+
+    Returns:
+        tuple: (moved, batches, seconds)
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    query = {"is_resolved": True, "updated_at": {"$lt": cutoff}}
+    started = time.monotonic()
+    moved = 0
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            docs = list(mongo.db.disaster_requests.find(query).sort("updated_at", 1).limit(batch_size))
+            if not docs:
+                break
+            archived_at = datetime.now(timezone.utc)
+            mongo.db.disaster_requests_archive.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, {**doc, "archived_at": archived_at}, upsert=True) for doc in docs],
+                ordered=False
+            )
+            # re-check the predicate, a request reopened meanwhile stays live
+            result = mongo.db.disaster_requests.delete_many({**query, "_id": {"$in": [doc["_id"] for doc in docs]}})
+            moved += result.deleted_count
+            batches += 1
+            if progress is not None:
+                progress(moved, batches)
+            if len(docs) < batch_size:
+                break
+            time.sleep(pause)
+    except Exception as e:
+        raise InternalServerError(description=f"Failed to archive resolved requests: {e}")
+    return moved, batches, time.monotonic() - started
+
 def extract_first_coordinate(polygon_text):
     """Extract the first coordinate pair from cap:polygon (space-separated pairs)"""
     if not polygon_text:
@@ -62,6 +493,22 @@ def extract_first_coordinate(polygon_text):
     
     return None
 
+def extract_polygon(polygon_text):
+    """Extract every (lat, lon) pair from cap:polygon, malformed pairs are skipped"""
+    if not polygon_text:
+        return []
+
+    ring = []
+    for pair in polygon_text.strip().split():
+        lat_lon = pair.split(",")
+        if len(lat_lon) != 2:
+            continue
+        try:
+            ring.append((float(lat_lon[0].strip()), float(lat_lon[1].strip())))
+        except ValueError:
+            continue
+    return ring
+
 def is_english(text: str) -> bool:
     """Return True if the text is mostly ASCII (basic English check)."""
     try:
@@ -70,66 +517,60 @@ def is_english(text: str) -> bool:
         return False
     return True
 
-def get_unique_disaster_list(temp: dict):
-    unique = {}  # title -> link
-
-    for title, link in temp.items():
-        if not is_english(title):
-            continue 
+DUPLICATE_THRESHOLD = 80
+DUPLICATE_BLOCK_SIZE = 256  # titles scored per cdist call by HeadlineIndex.add_many
 
-        keep = True
-        for u_title in list(unique.keys()):
-            # Check similarity
-            if fuzz.token_set_ratio(title, u_title) >= 80:
-                keep = False
-                break
-        if keep:
-            unique[title] = link
-    
-    return unique
-
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    Calculate the great-circle distance between two points
-    on the Earth specified in decimal degrees.
-    Returns distance in kilometers.
+class HeadlineIndex:
     """
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371  # Earth's radius in km
-    return c * r
+    Near-duplicate filter for feed titles: a title is dropped when its token_set_ratio
+    with any kept title is >= 80, the first one seen is kept.
 
-def sort_alerts_by_proximity(alerts: list, target_lat: float, target_lon: float):
+    Every kept title is compared, in native code: `add` scores one streamed title with
+    `extractOne`, `add_many` scores blocks of titles with `cdist`. No candidate buckets,
+    they miss duplicates that share no exact word with each other (typos).
     """
-    Sort a list of disaster alerts by proximity to a given latitude/longitude.
 
-    Args:
-        alerts (list): List of dicts, each must have 'first_coord' as [lat, lon] or None
-        target_lat (float): Latitude to sort by
-        target_lon (float): Longitude to sort by
+    def __init__(self, threshold: int = DUPLICATE_THRESHOLD, block_size: int = DUPLICATE_BLOCK_SIZE):
+        self.threshold = threshold
+        self.block_size = block_size
+        self.titles = []  # kept titles, in insertion order
 
-    Returns:
-        list: Sorted list of alerts (without 'first_coord')
-    """
-    for alert in alerts:
-        coord = alert["first_coord"]
-        if coord and len(coord) == 2:
-            alert["distance"] = haversine(coord[0], coord[1], target_lat, target_lon)
-        else:
-            alert["distance"] = float("inf")  # unknown or malformed location goes to the end
+    def add(self, title: str) -> bool:
+        """Insert the title, returns False when it is a near-duplicate of a kept title."""
+        if self.titles and process.extractOne(title, self.titles, scorer=fuzz.token_set_ratio,
+                                              score_cutoff=self.threshold) is not None:
+            return False
+        self.titles.append(title)
+        return True
 
-    # Sort by distance
-    alerts.sort(key=lambda x: x["distance"])
+    def add_many(self, titles: list) -> list:
+        """`add` every title in order, returns the kept ones. Same result as one by one."""
+        kept = []
+        for start in range(0, len(titles), self.block_size):
+            block = titles[start:start + self.block_size]
+            # block against the titles kept so far, and against itself
+            seen = process.cdist(block, self.titles, scorer=fuzz.token_set_ratio, score_cutoff=self.threshold,
+                                 dtype=np.uint8, workers=-1) if self.titles else None
+            inner = process.cdist(block, block, scorer=fuzz.token_set_ratio, score_cutoff=self.threshold,
+                                  dtype=np.uint8, workers=-1)
+            block_kept = []
+            for i, title in enumerate(block):
+                if seen is not None and seen[i].any():
+                    continue
+                if any(inner[i, j] for j in block_kept):
+                    continue
+                block_kept.append(i)
+            self.titles.extend(block[i] for i in block_kept)
+            kept.extend(block[i] for i in block_kept)
+        return kept
 
-    # # Remove 'first_coord' and 'distance' from final output
-    for alert in alerts:
-        alert.pop("first_coord", None)
-        alert.pop("distance", None)
+    def __len__(self):
+        return len(self.titles)
 
-    return alerts
+def get_unique_disaster_list(temp: dict):
+    """{title: link} of the English titles, near-duplicates of an earlier title dropped (batched HeadlineIndex)."""
+    titles = [title for title in temp if is_english(title)]
+    return {title: temp[title] for title in HeadlineIndex().add_many(titles)}
 
 def dump_alerts_to_json(alerts, filename="disaster_alerts.json"):
     """
@@ -165,4 +606,112 @@ def read_alerts_from_json(filename="disaster_alerts.json"):
         return []  # no file yet
     
     with open(filepath, "r", encoding="utf-8") as f:
-        return json.load(f)
\ No newline at end of file
+        return json.load(f)
+
+def parse_cap_timestamp(timestamp: str):
+    """Parse a CAP `sent` value (ISO 8601 with offset) into a UTC datetime, None if malformed."""
+    if not timestamp:
+        return None
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def alert_area_geojson(alert: dict):
+    """GeoJSON of the alert area accepted by a 2dsphere index (counter-clockwise shells), None if unknown."""
+    geometry = alert_geometry(alert)
+    if geometry is None:
+        return None
+    if geometry.geom_type == "Polygon":
+        geometry = orient(geometry)
+    elif isinstance(geometry, BaseMultipartGeometry):
+        geometry = type(geometry)([orient(part) for part in geometry.geoms])
+    return mapping(geometry)
+
+def area_bbox(area: dict) -> dict:
+    """Lon/lat bounds of a GeoJSON area, what the alert history bbox filter compares against."""
+    west, south, east, north = shape(area).bounds
+    return {"west": west, "south": south, "east": east, "north": north}
+
+def store_alert_history(alerts: list):
+    """Upsert the alerts into alert_history keyed by their CAP link, first_seen is kept across refreshes."""
+    if not alerts:
+        return
+    now = datetime.now(timezone.utc)
+    operations = []
+    for alert in alerts:
+        doc = {
+            "title": alert["title"],
+            "event": alert["event"],
+            "areas": alert["areas"],
+            "timestamp": parse_cap_timestamp(alert["timestamp"]),
+            "sent": alert["timestamp"],
+            "last_seen": now
+        }
+        area = alert_area_geojson(alert)
+        if area is not None:
+            doc["area"] = area
+            doc["area_bbox"] = area_bbox(area)
+        operations.append(UpdateOne(
+            {"_id": alert["link"]},
+            {"$set": doc, "$setOnInsert": {"first_seen": now}},
+            upsert=True
+        ))
+    try:
+        mongo.db.alert_history.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # an area mongo refuses to index should not drop the other alerts...
+        print(f"Alert history write partially failed: {e.details.get('writeErrors')}")
+
+def find_alert_history(start=None, end=None, bbox=None, event: str = None, page: int = 1, per_page: int = 50):
+    """
+    Query alert_history by time window, bounding box and event, newest first.
+
+    Args:
+        start (datetime): only alerts sent at or after this time
+        end (datetime): only alerts sent before this time
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat), alerts whose area bounds overlap it
+            (min_lon > max_lon crosses the antimeridian)
+        event (str): exact CAP event name
+        page (int): 1-based page number
+        per_page (int): alerts per page
+
+    Returns:
+        tuple: (alerts, has_more)
+    """
+    try:
+        query = {}
+        if start is not None or end is not None:
+            query["timestamp"] = {}
+            if start is not None:
+                query["timestamp"]["$gte"] = start
+            if end is not None:
+                query["timestamp"]["$lt"] = end
+        if event:
+            query["event"] = event
+        if bbox is not None:
+            # plain ranges on the stored area bounds, a geodesic polygon can't hold a
+            # world-wide or >180 degree wide box
+            min_lon, min_lat, max_lon, max_lat = bbox
+            query["area_bbox.south"] = {"$lte": max_lat}
+            query["area_bbox.north"] = {"$gte": min_lat}
+            if min_lon <= max_lon:
+                query["area_bbox.west"] = {"$lte": max_lon}
+                query["area_bbox.east"] = {"$gte": min_lon}
+            else:
+                query["$or"] = [{"area_bbox.east": {"$gte": min_lon}}, {"area_bbox.west": {"$lte": max_lon}}]
+
+        cursor = mongo.db.alert_history.find(query, {"area": 0, "area_bbox": 0}) \
+            .sort([("timestamp", -1), ("_id", 1)]) \
+            .skip((page - 1) * per_page) \
+            .limit(per_page + 1)
+        alerts = []
+        for doc in cursor:
+            doc["link"] = doc.pop("_id")
+            alerts.append(doc)
+        return alerts[:per_page], len(alerts) > per_page
+    except Exception as e:
+        raise InternalServerError(description=f"Alert history search failed: {e}")
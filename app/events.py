@@ -0,0 +1,157 @@
+import itertools
+import queue
+import threading
+import time
+from collections import defaultdict
+from pymongo.errors import OperationFailure, PyMongoError
+from app.database import mongo
+from app.geo import geohash_encode, geohash_cells_covering, radius_bounds, haversine
+from app.config import REQUEST_EVENTS_PRECISION, REQUEST_EVENTS_QUEUE_SIZE, REQUEST_EVENTS_CHANGE_STREAM
+
+class Subscription:
+    """One listener: a bounded queue of events near (lat, lon) within radius_km."""
+
+    def __init__(self, lat: float, lon: float, radius_km: float, cells: list, queue_size: int):
+        self.lat = lat
+        self.lon = lon
+        self.radius_km = radius_km
+        self.cells = cells
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0  # events lost because the client was not reading fast enough
+
+class RequestEventBus:
+    """
+    In-process pub/sub of disaster request events keyed by geohash cell.
+
+    A subscription is registered in every cell its circle touches, so publishing
+    an event only looks at the subscribers of the event's own cell.
+
+    Args:
+        precision (int): geohash length of the fan-out cells (4 is about 39 km x 19 km)
+        queue_size (int): events buffered per subscriber before new ones are dropped
+    """
+
+    def __init__(self, precision: int = 4, queue_size: int = 100):
+        self.precision = precision
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._cells = defaultdict(set)  # cell -> subscriptions
+        self._ids = itertools.count(1)
+        self.external_source = False  # True while a change stream feeds the bus
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, lat: float, lon: float, radius_km: float) -> Subscription:
+        cells = geohash_cells_covering(*radius_bounds(lat, lon, radius_km), self.precision)
+        subscription = Subscription(lat, lon, radius_km, cells, self.queue_size)
+        with self._lock:
+            for cell in cells:
+                self._cells[cell].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for cell in subscription.cells:
+                subscribers = self._cells.get(cell)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._cells[cell]
+
+    def publish(self, kind: str, doc: dict):
+        """Fan an event out to the subscribers whose circle contains the request."""
+        location = (doc or {}).get("location")
+        if not location:
+            return 0
+        lon, lat = location["coordinates"]
+        with self._lock:
+            subscribers = list(self._cells.get(geohash_encode(lat, lon, self.precision), ()))
+        self.published += 1
+        if not subscribers:
+            return 0
+
+        event = {"id": next(self._ids), "type": kind, "request": doc}
+        distances = haversine([s.lat for s in subscribers], [s.lon for s in subscribers], lat, lon)
+        delivered = 0
+        for subscription, distance in zip(subscribers, distances.tolist()):
+            if distance > subscription.radius_km:
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                delivered += 1
+            except queue.Full:
+                subscription.dropped += 1
+        self.delivered += delivered
+        return delivered
+
+    def stats(self):
+        with self._lock:
+            subscriptions = {s for subscribers in self._cells.values() for s in subscribers}
+            cells = len(self._cells)
+        return {
+            "subscribers": len(subscriptions),
+            "cells": cells,
+            "published": self.published,
+            "delivered": self.delivered,
+            "change_stream": self.external_source
+        }
+
+request_events = RequestEventBus(precision=REQUEST_EVENTS_PRECISION, queue_size=REQUEST_EVENTS_QUEUE_SIZE)
+_listener = None
+
+CHANGE_STREAM_PIPELINE = [{"$match": {
+    "ns.coll": {"$in": ["disaster_requests", "request_tombstones"]},
+    "operationType": {"$in": ["insert", "update", "replace"]}
+}}]
+
+def event_kind(change: dict) -> str:
+    """Map a change stream event on disaster_requests/request_tombstones to a request event type."""
+    if change["ns"]["coll"] == "request_tombstones":
+        return "cancelled"
+    if change["operationType"] == "insert":
+        return "created"
+    fields = change.get("updateDescription", {}).get("updatedFields", {})
+    if fields.get("is_resolved") is True:
+        return "resolved"
+    if "priority_count" in fields:
+        return "prioritized"
+    if any(key.startswith("active_responders") for key in fields):
+        return "helped"
+    return "updated"
+
+def _watch_requests(app):
+    resume_token = None
+    with app.app_context():
+        while True:
+            try:
+                with mongo.db.watch(CHANGE_STREAM_PIPELINE, full_document="updateLookup", resume_after=resume_token) as stream:
+                    request_events.external_source = True
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get("fullDocument")
+                        if doc is not None:
+                            request_events.publish(event_kind(change), doc)
+            except OperationFailure as e:
+                request_events.external_source = False
+                if e.code in (40573, 40324):  # standalone server, change streams need a replica set
+                    print(f"Change streams unavailable, publishing request events in-process: {e}")
+                    return
+                print(f"Request change stream failed, retrying: {e}")
+                time.sleep(5)
+            except PyMongoError as e:
+                request_events.external_source = False
+                print(f"Request change stream failed, retrying: {e}")
+                time.sleep(5)
+
+def start_change_stream_listener(app):
+    """
+    Feed the event bus from a MongoDB change stream when the deployment has one,
+    so events written by any worker reach every worker's subscribers. Until it is
+    up (or on a standalone server) the disaster write helpers publish in-process.
+    """
+    global _listener
+    if not REQUEST_EVENTS_CHANGE_STREAM or _listener is not None:
+        return
+    _listener = threading.Thread(target=_watch_requests, args=(app,), name="request-change-stream", daemon=True)
+    _listener.start()
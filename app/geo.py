@@ -0,0 +1,153 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+EARTH_RADIUS_M = 6371000.0
+WGS84_RADIUS_M = 6378137.0  # used by the map service ring sampling
+
+def haversine(lat1, lon1, lat2, lon2, radius: float = EARTH_RADIUS_KM):
+    """
+    Great-circle distance between points given in decimal degrees.
+    Arguments broadcast like numpy arrays, the result is in the unit of `radius` (km by default).
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    return 2.0 * radius * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """`haversine` in meters."""
+    return haversine(lat1, lon1, lat2, lon2, radius=EARTH_RADIUS_M)
+
+def destination_points(lat, lon, bearings_deg, distances_m, radius: float = WGS84_RADIUS_M):
+    """
+    Points reached from (lat, lon) after travelling `distances_m` along `bearings_deg`
+    (degrees clockwise from north), bearings and distances broadcast against each other.
+
+    Returns:
+        tuple: (lats, lons) arrays in decimal degrees
+    """
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    bearings = np.radians(np.asarray(bearings_deg, dtype=float))
+    angular = np.asarray(distances_m, dtype=float) / radius
+
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angular) + np.cos(lat1) * np.sin(angular) * np.cos(bearings))
+    lon2 = lon1 + np.arctan2(np.sin(bearings) * np.sin(angular) * np.cos(lat1),
+                             np.cos(angular) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(lon2)
+
+def initial_bearing(lat1, lon1, lat2, lon2):
+    """Initial bearing in degrees [0, 360) from the first point(s) towards the second point(s)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+def top_k_nearest(distances, k: int = None):
+    """
+    Indices of the `k` smallest distances, nearest first (all of them when k is None).
+    Uses argpartition so only the selected k are sorted, NaN/inf go last.
+    """
+    distances = np.asarray(distances, dtype=float)
+    n = distances.shape[0]
+    if k is None or k >= n:
+        return np.argsort(distances, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    selected = np.argpartition(distances, k - 1)[:k]
+    return selected[np.argsort(distances[selected], kind="stable")]
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash_encode(lat: float, lon: float, precision: int = 6) -> str:
+    """Standard base32 geohash of a point, `precision` characters long."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # longitude bit first
+    while len(chars) < precision:
+        value_range, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2.0
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+def geohash_bounds(cell: str):
+    """(min_lat, min_lon, max_lat, max_lon) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2.0
+            if (value >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def geohash_center(cell: str):
+    """(lat, lon) of the center of a geohash cell."""
+    min_lat, min_lon, max_lat, max_lon = geohash_bounds(cell)
+    return (min_lat + max_lat) / 2.0, (min_lon + max_lon) / 2.0
+
+def geohash_cells_covering(min_lat: float, min_lon: float, max_lat: float, max_lon: float, precision: int):
+    """Geohash cells of length `precision` intersecting the bounding box (no antimeridian wrap)."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    cell_width = 360.0 / (1 << lon_bits)
+    cell_height = 180.0 / (1 << lat_bits)
+
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    # walk the aligned grid by cell centers...
+    first_row = int(np.floor((min_lat + 90.0) / cell_height))
+    last_row = min(int(np.floor((max_lat + 90.0) / cell_height)), (1 << lat_bits) - 1)
+    first_col = int(np.floor((min_lon + 180.0) / cell_width))
+    last_col = min(int(np.floor((max_lon + 180.0) / cell_width)), (1 << lon_bits) - 1)
+
+    cells = []
+    for row in range(first_row, last_row + 1):
+        center_lat = -90.0 + (row + 0.5) * cell_height
+        for col in range(first_col, last_col + 1):
+            cells.append(geohash_encode(center_lat, -180.0 + (col + 0.5) * cell_width, precision))
+    return cells
+
+def radius_bounds(lat: float, lon: float, radius_km: float):
+    """(min_lat, min_lon, max_lat, max_lon) of the box around a circle of `radius_km`."""
+    dlat = float(np.degrees(radius_km / EARTH_RADIUS_KM))
+    dlon = dlat / max(float(np.cos(np.radians(lat))), 1e-6)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+MERCATOR_MAX_LAT = 85.05112878
+
+def tile_xy(lat, lon, zoom: int):
+    """
+    Web Mercator (slippy map) tile column/row of points at `zoom`, broadcasts like numpy arrays.
+
+    Returns:
+        tuple: (x, y) integer arrays, clamped to the 2**zoom grid
+    """
+    n = 1 << zoom
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT))
+    lon = np.asarray(lon, dtype=float)
+    x = np.floor((lon + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
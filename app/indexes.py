@@ -0,0 +1,65 @@
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT
+from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from app.database import mongo
+from app.config import TOMBSTONE_TTL_DAYS, SYNC_KEY_TTL_DAYS
+
+# collection -> list of (keys, options), create_index is a no-op for indexes that already exist
+INDEXES = {
+    "alert_history": [
+        ([("timestamp", DESCENDING), ("_id", ASCENDING)], {}),
+        ([("event", ASCENDING), ("timestamp", DESCENDING)], {}),
+        ([("area", GEOSPHERE)], {}),
+    ],
+    "disaster_requests": [
+        ([("location", GEOSPHERE), ("is_resolved", ASCENDING)], {}),
+        # the next two also answer (username, is_resolved) and (is_resolved) lookups through their prefixes...
+        ([("username", ASCENDING), ("is_resolved", ASCENDING), ("priority_score", DESCENDING), ("_id", DESCENDING)], {}),
+        ([("is_resolved", ASCENDING), ("priority_score", DESCENDING), ("_id", DESCENDING)], {}),
+        ([("updated_at", ASCENDING)], {}),
+        ([("is_resolved", ASCENDING), ("updated_at", ASCENDING)], {}),
+        # the only text index a collection may have, searches must give is_resolved...
+        ([("is_resolved", ASCENDING), ("message", TEXT), ("disaster_type", TEXT)],
+         {"name": "request_text", "weights": {"disaster_type": 3, "message": 1}, "default_language": "english"}),
+    ],
+    "disaster_requests_archive": [
+        ([("username", ASCENDING), ("is_resolved", ASCENDING), ("priority_score", DESCENDING), ("_id", DESCENDING)], {}),
+        ([("archived_at", ASCENDING)], {}),
+    ],
+    "users": [
+        # login/register lookups, and no two accounts can share a username...
+        ([("username", ASCENDING)], {"unique": True}),
+        # $geoNear of responder matching, the filter fields ride along in the same index...
+        ([("location", GEOSPHERE), ("is_verified_ngo", ASCENDING), ("is_active", ASCENDING)], {}),
+    ],
+    "request_clusters": [
+        ([("z", ASCENDING), ("x", ASCENDING), ("y", ASCENDING)], {}),
+    ],
+    "request_rollups": [
+        ([("cell", ASCENDING), ("hour", ASCENDING)], {}),
+        ([("hour", ASCENDING)], {}),
+    ],
+    "request_terms": [
+        ([("count", DESCENDING)], {}),
+    ],
+    "sync_operations": [
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": SYNC_KEY_TTL_DAYS * 86400}),
+    ],
+    "request_tombstones": [
+        ([("updated_at", ASCENDING)], {"expireAfterSeconds": TOMBSTONE_TTL_DAYS * 86400}),
+    ],
+}
+
+def ensure_indexes():
+    """Create the indexes the queries rely on, one failing index does not stop the others."""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                mongo.db[collection].create_index(keys, **options)
+            except ServerSelectionTimeoutError as e:
+                # database unreachable, don't block startup once per index...
+                print(f"Skipping index creation, MongoDB is unreachable: {e}")
+                return
+            except DuplicateKeyError as e:
+                print(f"Cannot create unique index {keys} on {collection}, remove the duplicate documents first: {e}")
+            except Exception as e:
+                print(f"Failed to create index {keys} on {collection}: {e}")
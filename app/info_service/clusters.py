@@ -0,0 +1,187 @@
+from collections import defaultdict
+import numpy as np
+from pymongo import UpdateOne, InsertOne
+from app.database import mongo
+from app.indexes import INDEXES
+from app.geo import tile_xy
+from app.config import CLUSTER_MAX_ZOOM, CLUSTER_GRID_OFFSET, CLUSTER_MAX_CELLS
+
+# one rollup per Web Mercator tile of every zoom 0..CLUSTER_MAX_ZOOM holding the open requests inside it:
+# {"_id": "z/x/y", "z", "x", "y", "count", "sum_lat", "sum_lon", "types": {type: n}, "priorities": {"p": n}}
+# counters only ever move by $inc, so concurrent writers never lose updates...
+CLUSTER_LEVELS = range(CLUSTER_MAX_ZOOM + 1)
+REBUILD_BATCH_SIZE = 1000
+
+def _type_key(disaster_type) -> str:
+    # disaster types are free text, keep them usable as field names
+    return (str(disaster_type or "").replace(".", "_").lstrip("$")) or "unknown"
+
+def _contribution(doc: dict):
+    """(lat, lon, type, priority) an open request adds to the clusters, None when it adds nothing."""
+    if not doc or doc.get("is_resolved") or not doc.get("location"):
+        return None
+    lon, lat = doc["location"]["coordinates"]
+    return float(lat), float(lon), _type_key(doc.get("disaster_type")), int(doc.get("priority_count") or 0)
+
+def _add(increments: dict, contribution, sign: int):
+    lat, lon, disaster_type, priority = contribution
+    for z in CLUSTER_LEVELS:
+        x, y = tile_xy(lat, lon, z)
+        inc = increments[(z, int(x), int(y))]
+        inc["count"] += sign
+        inc["sum_lat"] += sign * lat
+        inc["sum_lon"] += sign * lon
+        inc[f"types.{disaster_type}"] += sign
+        inc[f"priorities.{priority}"] += sign
+
+def cluster_updates(changes):
+    """Rollup writes moving requests from their `before` to their `after` state, for (before, after) pairs (None = not there)."""
+    increments = defaultdict(lambda: defaultdict(int))
+    for before, after in changes:
+        old, new = _contribution(before), _contribution(after)
+        if old == new:
+            continue
+        if old is not None:
+            _add(increments, old, -1)
+        if new is not None:
+            _add(increments, new, 1)
+
+    operations = []
+    for (z, x, y), inc in increments.items():
+        inc = {field: value for field, value in inc.items() if value != 0}
+        if not inc:
+            continue
+        operations.append(UpdateOne(
+            {"_id": f"{z}/{x}/{y}"},
+            {"$inc": inc, "$setOnInsert": {"z": z, "x": x, "y": y}},
+            upsert=True
+        ))
+    return operations
+
+def update_request_clusters(before: dict, after: dict):
+    """Keep the cluster rollups in sync with one request write, a single round trip."""
+    update_request_clusters_many([(before, after)])
+
+def update_request_clusters_many(changes):
+    """`update_request_clusters` for many (before, after) pairs, per-cell increments are merged first."""
+    operations = cluster_updates(changes)
+    if operations:
+        mongo.db.request_clusters.bulk_write(operations, ordered=False)
+
+def _tile_ranges(min_lon: float, min_lat: float, max_lon: float, max_lat: float, z: int):
+    # bounding boxes crossing the antimeridian (min_lon > max_lon) become two column ranges
+    lon_spans = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    ranges = []
+    for west, east in lon_spans:
+        (x0, x1), (y0, y1) = tile_xy([max_lat, min_lat], [west, east], z)  # rows grow southwards, north edge first
+        ranges.append((int(x0), int(x1), int(y0), int(y1)))
+    return ranges
+
+def cluster_level(min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int):
+    """
+    Grid level answering a map view at `zoom`, a few cells per screen tile, coarser
+    when the box would cover more than CLUSTER_MAX_CELLS cells.
+
+    Returns:
+        tuple: (level, tile ranges [(x0, x1, y0, y1), ...])
+    """
+    level = min(max(int(zoom), 0) + CLUSTER_GRID_OFFSET, CLUSTER_MAX_ZOOM)
+    while True:
+        ranges = _tile_ranges(min_lon, min_lat, max_lon, max_lat, level)
+        cells = sum((x1 - x0 + 1) * (y1 - y0 + 1) for x0, x1, y0, y1 in ranges)
+        if cells <= CLUSTER_MAX_CELLS or level == 0:
+            return level, ranges
+        level -= 1
+
+def find_request_clusters(min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int):
+    """
+    Clusters of open requests inside a bounding box for a map zoom level, read from the
+    rollups through the (z, x, y) index so the cost follows the cells on screen, not the requests.
+
+    Returns:
+        tuple: (grid level used, list of clusters)
+    """
+    level, ranges = cluster_level(min_lon, min_lat, max_lon, max_lat, zoom)
+    query = {
+        "z": level,
+        "count": {"$gt": 0},
+        "$or": [{"x": {"$gte": x0, "$lte": x1}, "y": {"$gte": y0, "$lte": y1}} for x0, x1, y0, y1 in ranges]
+    }
+
+    clusters = []
+    for doc in mongo.db.request_clusters.find(query):
+        count = doc["count"]
+        types = {name: n for name, n in (doc.get("types") or {}).items() if n > 0}
+        priorities = [int(p) for p, n in (doc.get("priorities") or {}).items() if n > 0]
+        clusters.append({
+            "cell": doc["_id"],
+            "count": count,
+            "latitude": doc["sum_lat"] / count,
+            "longitude": doc["sum_lon"] / count,
+            "disaster_type": max(types, key=types.get) if types else "",
+            "max_priority": max(priorities) if priorities else 0
+        })
+    return level, clusters
+
+def rebuild_request_clusters():
+    """
+    Recompute every rollup from the open requests into a scratch collection and swap it in,
+    repairs drift from writes made outside the app. Returns (requests, cells).
+    """
+    cells = defaultdict(lambda: {"count": 0, "sum_lat": 0.0, "sum_lon": 0.0,
+                                 "types": defaultdict(int), "priorities": defaultdict(int)})
+    cursor = mongo.db.disaster_requests.find(
+        {"is_resolved": False, "location": {"$exists": True}},
+        {"location": 1, "disaster_type": 1, "priority_count": 1, "is_resolved": 1}
+    ).batch_size(REBUILD_BATCH_SIZE)
+
+    total = 0
+    batch = []
+    def flush():
+        if not batch:
+            return
+        lats = np.array([item[0] for item in batch])
+        lons = np.array([item[1] for item in batch])
+        for z in CLUSTER_LEVELS:
+            xs, ys = tile_xy(lats, lons, z)  # whole batch per level, vectorized
+            for (lat, lon, disaster_type, priority), x, y in zip(batch, xs.tolist(), ys.tolist()):
+                cell = cells[(z, x, y)]
+                cell["count"] += 1
+                cell["sum_lat"] += lat
+                cell["sum_lon"] += lon
+                cell["types"][disaster_type] += 1
+                cell["priorities"][str(priority)] += 1
+        batch.clear()
+
+    for doc in cursor:
+        contribution = _contribution(doc)
+        if contribution is None:
+            continue
+        batch.append(contribution)
+        total += 1
+        if len(batch) == REBUILD_BATCH_SIZE:
+            flush()
+    flush()
+
+    scratch = mongo.db.request_clusters_rebuild
+    scratch.drop()
+    operations = []
+    for (z, x, y), cell in cells.items():
+        operations.append(InsertOne({
+            "_id": f"{z}/{x}/{y}", "z": z, "x": x, "y": y,
+            "count": cell["count"], "sum_lat": cell["sum_lat"], "sum_lon": cell["sum_lon"],
+            "types": dict(cell["types"]), "priorities": dict(cell["priorities"])
+        }))
+        if len(operations) == REBUILD_BATCH_SIZE:
+            scratch.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        scratch.bulk_write(operations, ordered=False)
+
+    if cells:
+        for keys, options in INDEXES["request_clusters"]:
+            scratch.create_index(keys, **options)
+        scratch.rename("request_clusters", dropTarget=True)
+    else:
+        mongo.db.request_clusters.delete_many({})
+    return total, len(cells)
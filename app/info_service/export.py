@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from flask import Response
+from werkzeug.exceptions import BadRequest
+from app.database import mongo
+
+# Exports stream straight from a Mongo cursor: documents are formatted into ~64 KB
+# text chunks (optionally gzip-compressed chunk by chunk), so a worker holds one
+# cursor batch and one chunk at a time whatever the size of the export.
+
+EXPORT_BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+EXPORT_FIELDS = ["_id", "username", "phone", "latitude", "longitude", "disaster_type", "message",
+                 "created_at", "is_resolved", "priority_count", "priority_score", "responders", "updated_at"]
+EXPORT_PROJECTION = {
+    "username": 1, "phone": 1, "location": 1, "latitude": 1, "longitude": 1, "disaster_type": 1, "message": 1,
+    "created_at": 1, "is_resolved": 1, "priority_count": 1, "priority_score": 1, "active_responders": 1, "updated_at": 1
+}
+
+def export_query(types: list = None, bbox: tuple = None, resolved: str = "0") -> dict:
+    """
+    Filter of an export.
+
+    Args:
+        types (list): disaster types to keep, None for all
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat), None for everywhere
+        resolved (str): "0" open only, "1" resolved only, "all" both
+    """
+    query = {}
+    if resolved == "0":
+        query["is_resolved"] = False
+    elif resolved == "1":
+        query["is_resolved"] = True
+    elif resolved != "all":
+        raise BadRequest("resolved must be 0, 1 or all")
+    if types:
+        query["disaster_type"] = {"$in": types}
+    if bbox:
+        # plain ranges on the stored [lon, lat], a geodesic polygon would bow its edges
+        # toward the poles and could not hold a world-wide or >180 degree wide box
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if min_lat > -90 or max_lat < 90:
+            query["location.coordinates.1"] = {"$gte": min_lat, "$lte": max_lat}
+        if min_lon > max_lon:  # crosses the antimeridian
+            query["$or"] = [{"location.coordinates.0": {"$gte": min_lon}}, {"location.coordinates.0": {"$lte": max_lon}}]
+        elif min_lon > -180 or max_lon < 180:
+            query["location.coordinates.0"] = {"$gte": min_lon, "$lte": max_lon}
+        else:
+            query["location"] = {"$exists": True}
+    return query
+
+def find_export_requests(query: dict):
+    """Cursor over the matching requests, fetched EXPORT_BATCH_SIZE documents per round trip."""
+    return mongo.db.disaster_requests.find(query, EXPORT_PROJECTION).batch_size(EXPORT_BATCH_SIZE)
+
+def _iso(value):
+    if isinstance(value, datetime):
+        return (value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)).isoformat()
+    return value
+
+def export_row(doc: dict) -> dict:
+    """Flat export record of a request, coordinates from the GeoJSON location when present."""
+    location = doc.get("location")
+    lon, lat = location["coordinates"] if location else (doc.get("longitude"), doc.get("latitude"))
+    return {
+        "_id": doc["_id"],
+        "username": doc.get("username"),
+        "phone": doc.get("phone"),
+        "latitude": lat,
+        "longitude": lon,
+        "disaster_type": doc.get("disaster_type"),
+        "message": doc.get("message"),
+        "created_at": _iso(doc.get("created_at")),
+        "is_resolved": doc.get("is_resolved"),
+        "priority_count": doc.get("priority_count"),
+        "priority_score": doc.get("priority_score"),
+        "responders": len(doc.get("active_responders") or []),
+        "updated_at": _iso(doc.get("updated_at"))
+    }
+
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _csv_cell(value):
+    # user text starting like a formula would run in a spreadsheet, a leading ' keeps it text
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_csv(docs):
+    """CSV text of the documents, yielded in chunks of about CHUNK_SIZE characters."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for doc in docs:
+        writer.writerow({field: _csv_cell(value) for field, value in export_row(doc).items()})
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_geojson(docs):
+    """GeoJSON FeatureCollection text of the documents, yielded in chunks."""
+    parts = ['{"type": "FeatureCollection", "features": [']
+    size = len(parts[0])
+    first = True
+    for doc in docs:
+        row = export_row(doc)
+        if row["latitude"] is None or row["longitude"] is None:
+            continue
+        lat, lon = row.pop("latitude"), row.pop("longitude")
+        feature = json.dumps({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": row
+        }, default=str)
+        parts.append(feature if first else "," + feature)
+        size += len(parts[-1])
+        first = False
+        if size >= CHUNK_SIZE:
+            yield "".join(parts)
+            parts, size = [], 0
+    parts.append("]}")
+    yield "".join(parts)
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks on the fly (one compressor, output yielded as it comes)."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv; charset=utf-8"),
+    "geojson": (iter_geojson, "application/geo+json")
+}
+
+def export_response(query: dict, file_format: str, gzip: bool = False) -> Response:
+    """
+    Streaming download of the requests matching `query`. With gzip the body is a .gz file
+    compressed while it streams (not a Content-Encoding), so spreadsheet and GIS users get
+    a file they can keep. The cursor is opened on the first read and always closed.
+    """
+    formatter, mimetype = EXPORT_FORMATS[file_format]
+    filename = f"requests.{file_format}"
+    if gzip:
+        mimetype, filename = "application/gzip", filename + ".gz"
+
+    def generate():
+        cursor = find_export_requests(query)
+        try:
+            body = formatter(cursor)
+            yield from gzip_chunks(body) if gzip else body
+        finally:
+            cursor.close()  # client went away or export done, release the server cursor
+
+    response = Response(generate(), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
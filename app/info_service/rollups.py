@@ -0,0 +1,178 @@
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from pymongo import UpdateOne, InsertOne
+from app.database import mongo
+from app.indexes import INDEXES
+from app.geo import geohash_encode, geohash_center, geohash_cells_covering
+from app.config import ROLLUP_PRECISION, ROLLUP_MAX_CELLS
+
+# situational counts for dashboards, one rollup per (geohash cell, hour the request was made, type):
+# {"_id": "cell|hour|type", "cell", "lat", "lon", "hour", "disaster_type",
+#  "total", "open", "resolved", "responded"}
+# `responded` counts the open requests with at least one responder. A request stays in its
+# bucket for life, status changes only move counters inside it with $inc. Archived requests
+# keep counting, cancelled (deleted) ones are taken out.
+COUNTERS = ("total", "open", "resolved", "responded")
+REBUILD_BATCH_SIZE = 1000
+
+def _hour(value) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def _bucket(doc: dict):
+    """((cell, hour, type), counters) a request adds to the rollups, None when it adds nothing."""
+    if not doc or not doc.get("location") or not isinstance(doc.get("created_at"), datetime):
+        return None
+    lon, lat = doc["location"]["coordinates"]
+    is_resolved = bool(doc.get("is_resolved"))
+    counters = {
+        "total": 1,
+        "open": 0 if is_resolved else 1,
+        "resolved": 1 if is_resolved else 0,
+        "responded": 1 if not is_resolved and doc.get("active_responders") else 0
+    }
+    key = (geohash_encode(float(lat), float(lon), ROLLUP_PRECISION), _hour(doc["created_at"]), str(doc.get("disaster_type") or "unknown"))
+    return key, counters
+
+def rollup_updates(changes):
+    """Rollup writes moving requests from their `before` to their `after` state, for (before, after) pairs (None = not there)."""
+    increments = defaultdict(lambda: defaultdict(int))
+    for before, after in changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            bucket = _bucket(doc)
+            if bucket is None:
+                continue
+            key, counters = bucket
+            for field, value in counters.items():
+                increments[key][field] += sign * value
+
+    operations = []
+    for (cell, hour, disaster_type), inc in increments.items():
+        inc = {field: value for field, value in inc.items() if value != 0}
+        if not inc:
+            continue
+        lat, lon = geohash_center(cell)
+        operations.append(UpdateOne(
+            {"_id": f"{cell}|{hour.isoformat()}|{disaster_type}"},
+            {"$inc": inc, "$setOnInsert": {"cell": cell, "lat": lat, "lon": lon, "hour": hour, "disaster_type": disaster_type}},
+            upsert=True
+        ))
+    return operations
+
+def update_request_rollups(before: dict, after: dict):
+    """Keep the rollups in sync with one request write, a single round trip."""
+    update_request_rollups_many([(before, after)])
+
+def update_request_rollups_many(changes):
+    operations = rollup_updates(changes)
+    if operations:
+        mongo.db.request_rollups.bulk_write(operations, ordered=False)
+
+def _cell_filter(min_lon: float, min_lat: float, max_lon: float, max_lat: float):
+    # covering cells of the box, as coarse as needed to stay under ROLLUP_MAX_CELLS prefixes
+    spans = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    for precision in range(ROLLUP_PRECISION, 0, -1):
+        cells = [cell for west, east in spans for cell in geohash_cells_covering(min_lat, west, max_lat, east, precision)]
+        if len(cells) <= ROLLUP_MAX_CELLS:
+            break
+    if precision == ROLLUP_PRECISION:
+        return {"cell": {"$in": cells}}
+    return {"$or": [{"cell": re.compile("^" + cell)} for cell in cells]}  # anchored prefixes walk the index
+
+def find_request_rollups(bbox: tuple = None, since: datetime = None, until: datetime = None,
+                         types: list = None, precision: int = ROLLUP_PRECISION, by_type: bool = True):
+    """
+    Request counts per region (geohash prefix of `precision` characters) and type, read
+    from the rollups so the cost follows the cells and hours covered, not the requests.
+
+    Args:
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat), None for everywhere
+        since, until (datetime): only requests made in [since, until)
+        types (list): disaster types to keep, None for all
+        precision (int): geohash length of a region, 1..ROLLUP_PRECISION
+        by_type (bool): one row per region and type, else one row per region
+
+    Returns:
+        list: [{"cell", "disaster_type", "latitude", "longitude", "total", "open", "resolved", "responded"}]
+    """
+    match = {}
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        match.update(_cell_filter(min_lon, min_lat, max_lon, max_lat))
+        # coarse prefixes overshoot the box, keep the cells centered inside it
+        match["lat"] = {"$gte": min_lat, "$lte": max_lat}
+        if min_lon <= max_lon:
+            match["lon"] = {"$gte": min_lon, "$lte": max_lon}
+        else:
+            match["$and"] = [{"$or": [{"lon": {"$gte": min_lon}}, {"lon": {"$lte": max_lon}}]}]
+    if since is not None or until is not None:
+        match["hour"] = {}
+        if since is not None:
+            match["hour"]["$gte"] = _hour(since)
+        if until is not None:
+            match["hour"]["$lt"] = until.astimezone(timezone.utc).replace(tzinfo=None) if until.tzinfo else until
+    if types:
+        match["disaster_type"] = {"$in": types}
+
+    group_id = {"cell": {"$substrCP": ["$cell", 0, int(precision)]}}
+    if by_type:
+        group_id["disaster_type"] = "$disaster_type"
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": group_id, **{field: {"$sum": f"${field}"} for field in COUNTERS}}},
+        {"$match": {"total": {"$gt": 0}}},
+        {"$sort": {"open": -1, "_id.cell": 1}}
+    ]
+
+    rollups = []
+    for doc in mongo.db.request_rollups.aggregate(pipeline):
+        lat, lon = geohash_center(doc["_id"]["cell"])
+        row = {"cell": doc["_id"]["cell"], "latitude": lat, "longitude": lon}
+        if by_type:
+            row["disaster_type"] = doc["_id"]["disaster_type"]
+        row.update({field: doc[field] for field in COUNTERS})
+        rollups.append(row)
+    return rollups
+
+def rebuild_request_rollups():
+    """
+    Recount every rollup from the live and archived requests into a scratch collection and
+    swap it in, repairs drift from writes made outside the app. Returns (requests, rollups).
+    """
+    totals = defaultdict(lambda: defaultdict(int))
+    projection = {"location": 1, "created_at": 1, "disaster_type": 1, "is_resolved": 1, "active_responders": 1}
+    requests = 0
+    for collection in (mongo.db.disaster_requests, mongo.db.disaster_requests_archive):
+        for doc in collection.find({"location": {"$exists": True}}, projection).batch_size(REBUILD_BATCH_SIZE):
+            bucket = _bucket(doc)
+            if bucket is None:
+                continue
+            key, counters = bucket
+            for field, value in counters.items():
+                totals[key][field] += value
+            requests += 1
+
+    scratch = mongo.db.request_rollups_rebuild
+    scratch.drop()
+    operations = []
+    for (cell, hour, disaster_type), counters in totals.items():
+        lat, lon = geohash_center(cell)
+        operations.append(InsertOne({
+            "_id": f"{cell}|{hour.isoformat()}|{disaster_type}", "cell": cell, "lat": lat, "lon": lon,
+            "hour": hour, "disaster_type": disaster_type, **{field: counters[field] for field in COUNTERS}
+        }))
+        if len(operations) == REBUILD_BATCH_SIZE:
+            scratch.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        scratch.bulk_write(operations, ordered=False)
+
+    if totals:
+        for keys, options in INDEXES["request_rollups"]:
+            scratch.create_index(keys, **options)
+        scratch.rename("request_rollups", dropTarget=True)
+    else:
+        mongo.db.request_rollups.delete_many({})
+    return requests, len(totals)
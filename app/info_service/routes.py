@@ -1,9 +1,33 @@
 from app.info_service import info
 from werkzeug.exceptions import InternalServerError, BadRequest
-from flask import request
-from app.info_service.utils import find_valid_requests, find_common_requests, sort_alerts_by_proximity
+from flask import request, jsonify, Response
+from datetime import datetime, timezone
+from app.info_service.utils import find_valid_requests, find_common_requests, valid_requests_next_token, common_requests_next_token, stream_json_array, paginated, parse_since, needs_full_sync, request_changes_watermark, find_request_changes, changes_etag, cached_common_requests, common_requests_cache, stream_request_events, find_top_requests
+from app.info_service.clusters import find_request_clusters
+from app.info_service.search import search_requests
+from app.info_service.rollups import find_request_rollups
+from app.info_service.export import export_query, export_response, EXPORT_FORMATS
+from app.events import request_events
+from app.config import SSE_HEARTBEAT_SECONDS, SSE_MAX_RADIUS_KM, ROLLUP_PRECISION
 from app.auth_service.utils import find_user
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def parse_limit(value):
+    """A client supplied page size as int, None when absent, BadRequest unless it is in 1..MAX_PAGE_SIZE."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise BadRequest(f"limit must be an integer between 1 and {MAX_PAGE_SIZE}")
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"limit must be an integer between 1 and {MAX_PAGE_SIZE}")
+    if not (0 < limit <= MAX_PAGE_SIZE):
+        raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
 @info.route("/get_requests/<string:username>", methods=["GET"]) # all open/closed requests made by the user...
 def get_all_open_requests_by_user(username):
     try:
@@ -11,9 +35,19 @@ def get_all_open_requests_by_user(username):
         is_resolved = True
         if opened=="1":
             is_resolved = False
-        open_requests = find_valid_requests(username, is_resolved)
-        open_requests.sort(key=lambda x: x.get("priority_count"))
-        return open_requests
+        limit = parse_limit(request.args.get("limit"))
+        after = request.args.get("next")
+
+        if request.args.get("stream") == "1":
+            return stream_json_array(find_valid_requests(username, is_resolved, limit, after))
+        if limit is None and after is None:
+            return list(find_valid_requests(username, is_resolved))
+
+        limit = limit or DEFAULT_PAGE_SIZE
+        # one extra document tells whether there is a next page...
+        return paginated(find_valid_requests(username, is_resolved, limit + 1, after), limit, valid_requests_next_token)
+    except BadRequest as e:
+        raise e
     except Exception as e:
         print(e)
         raise InternalServerError(description=f"Failed to fetch all open requests: {e}")
@@ -26,14 +60,206 @@ def get_common_requests():
             raise BadRequest("Missing JSON body")
         lat = data["latitude"]
         lon = data["longitude"]
-        open_common_requests = find_common_requests()
-        print(open_common_requests)
-        open_common_requests = sort_alerts_by_proximity(open_common_requests, lat, lon)
-        return open_common_requests
+        max_distance = data.get("max_distance")  # km
+        limit = parse_limit(data.get("limit"))
+        after = data.get("next")
+
+        if data.get("since"):
+            return get_common_request_changes(parse_since(data["since"]), lat, lon, max_distance)
+        if data.get("stream"):
+            return stream_json_array(find_common_requests(lat, lon, max_distance, limit, after))
+        if limit is None and after is None:
+            return cached_common_requests(lat, lon, max_distance)
+
+        limit = limit or DEFAULT_PAGE_SIZE
+        return paginated(cached_common_requests(lat, lon, max_distance, limit + 1, after), limit, common_requests_next_token)
+    except BadRequest as e:
+        raise e
     except Exception as e:
         print(e)
         raise InternalServerError(description=f"Failed to fetch all open requests: {e}")
 
+def get_common_request_changes(since, lat, lon, max_distance):
+    # delta sync: only what changed since the client's watermark, 304 when nothing did...
+    if needs_full_sync(since):
+        # taken before the client's full reload, so nothing written meanwhile is missed
+        return jsonify({
+            "changes": [],
+            "deleted": [],
+            "full_sync_required": True,
+            "watermark": datetime.now(timezone.utc).isoformat()
+        })
+
+    watermark = request_changes_watermark(since, lat, lon, max_distance)
+    etag = changes_etag(since, watermark, lat, lon, max_distance)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    changes = find_request_changes(since, lat, lon, max_distance)
+    changes["watermark"] = watermark.isoformat()
+    response = jsonify(changes)
+    response.set_etag(etag)
+    return response
+
+@info.route("/top_requests", methods=["GET"]) # highest priority open requests...
+def top_requests():
+    try:
+        limit = request.args.get("limit", default=DEFAULT_PAGE_SIZE, type=int)
+        if not (0 < limit <= 500):
+            raise BadRequest("limit must be between 1 and 500")
+        return jsonify(find_top_requests(limit)), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch top requests: {e}")
+
+@info.route("/request_clusters", methods=["GET"]) # open requests aggregated for a map view...
+def request_clusters():
+    try:
+        bbox = request.args.get("bbox")  # min_lon,min_lat,max_lon,max_lat
+        zoom = request.args.get("zoom", type=int)
+        if not bbox or zoom is None:
+            raise BadRequest("bbox and zoom are required")
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+        except ValueError:
+            raise BadRequest("bbox must be min_lon,min_lat,max_lon,max_lat")
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+            raise BadRequest("Invalid bbox")
+        if zoom < 0:
+            raise BadRequest("zoom must not be negative")
+
+        level, clusters = find_request_clusters(min_lon, min_lat, max_lon, max_lat, zoom)
+        return jsonify({"zoom": zoom, "grid_zoom": level, "clusters": clusters}), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch request clusters: {e}")
+
+@info.route("/request_rollups", methods=["GET"]) # request counts per region and type for dashboards...
+def request_rollups():
+    try:
+        bbox = request.args.get("bbox")  # min_lon,min_lat,max_lon,max_lat
+        if bbox:
+            try:
+                bbox = tuple(float(value) for value in bbox.split(","))
+                min_lon, min_lat, max_lon, max_lat = bbox
+            except ValueError:
+                raise BadRequest("bbox must be min_lon,min_lat,max_lon,max_lat")
+            if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                raise BadRequest("Invalid bbox")
+        since = request.args.get("since")
+        since = parse_since(since) if since else None
+        until = request.args.get("until")
+        try:
+            until = parse_since(until) if until else None
+        except BadRequest:
+            raise BadRequest("until must be an ISO 8601 timestamp")
+        precision = request.args.get("precision", default=ROLLUP_PRECISION, type=int)
+        if not (1 <= precision <= ROLLUP_PRECISION):
+            raise BadRequest(f"precision must be between 1 and {ROLLUP_PRECISION}")
+        types = [value.strip() for value in request.args.get("type", default="").split(",") if value.strip()]
+        by_type = request.args.get("by_type", default="1") in ("1", "true")
+
+        rollups = find_request_rollups(bbox or None, since, until, types or None, precision, by_type)
+        return jsonify({"precision": precision, "rollups": rollups}), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch request rollups: {e}")
+
+@info.route("/stream_requests", methods=["GET"]) # live new/updated requests near a location (SSE)...
+def stream_requests():
+    try:
+        lat = request.args.get("lat", type=float)
+        lon = request.args.get("lon", type=float)
+        radius = request.args.get("radius", default=10.0, type=float)  # km
+        if lat is None or lon is None:
+            raise BadRequest("lat and lon are required")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise BadRequest("Invalid lat/lon")
+        if not (0 < radius <= SSE_MAX_RADIUS_KM):
+            raise BadRequest(f"radius must be within (0, {SSE_MAX_RADIUS_KM}] km")
+        return stream_request_events(request_events, lat, lon, radius, SSE_HEARTBEAT_SECONDS)
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to open the request stream: {e}")
+
+@info.route("/search_requests", methods=["GET"]) # free-text search of request messages...
+def search_requests_route():
+    try:
+        q = request.args.get("q", default="").strip()
+        if not q:
+            raise BadRequest("q is required")
+        resolved = request.args.get("resolved", default="0")
+        if resolved not in ("0", "1"):
+            raise BadRequest("resolved must be 0 or 1")
+        limit = request.args.get("limit", default=DEFAULT_PAGE_SIZE, type=int)
+        if not (0 < limit <= 200):
+            raise BadRequest("limit must be between 1 and 200")
+        lat = request.args.get("lat", type=float)
+        lon = request.args.get("lon", type=float)
+        radius = request.args.get("radius", type=float)  # km
+        if (lat is None) != (lon is None):
+            raise BadRequest("lat and lon go together")
+        if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise BadRequest("Invalid lat/lon")
+        if radius is not None and (lat is None or radius <= 0):
+            raise BadRequest("radius needs lat/lon and must be positive")
+
+        words, results = search_requests(q, resolved == "1", lat, lon, radius, limit)
+        return jsonify({"query": q, "terms": words, "results": results}), 200
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to search requests: {e}")
+
+@info.route("/export_requests", methods=["GET"]) # CSV/GeoJSON download streamed from the database...
+def export_requests():
+    try:
+        file_format = request.args.get("format", default="csv").lower()
+        if file_format not in EXPORT_FORMATS:
+            raise BadRequest("format must be csv or geojson")
+        gzip = request.args.get("gzip", default="0") in ("1", "true")
+        resolved = request.args.get("resolved", default="0")
+        types = [value.strip() for value in request.args.get("type", default="").split(",") if value.strip()]
+
+        bbox = request.args.get("bbox")  # min_lon,min_lat,max_lon,max_lat
+        if bbox:
+            try:
+                bbox = tuple(float(value) for value in bbox.split(","))
+                min_lon, min_lat, max_lon, max_lat = bbox
+            except ValueError:
+                raise BadRequest("bbox must be min_lon,min_lat,max_lon,max_lat")
+            if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+                raise BadRequest("Invalid bbox")
+
+        query = export_query(types or None, bbox or None, resolved)
+        return export_response(query, file_format, gzip)
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to export requests: {e}")
+
+@info.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    try:
+        stats = common_requests_cache.stats()
+        stats["events"] = request_events.stats()
+        return jsonify(stats)
+    except Exception as e:
+        print(e)
+        raise InternalServerError(description=f"Failed to fetch cache stats: {e}")
+
 @info.route("/get_user_detail/<string:username>", methods=["GET"])
 def get_users_details(username):
     try:
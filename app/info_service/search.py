@@ -0,0 +1,153 @@
+import re
+from collections import Counter
+import numpy as np
+from pymongo import UpdateOne, InsertOne, DESCENDING
+from rapidfuzz import fuzz, process, utils
+from app.database import mongo
+from app.indexes import INDEXES
+from app.cache import LRUCache
+from app.geo import haversine, EARTH_RADIUS_KM
+from app.info_service.utils import REQUEST_PROJECTION
+from app.config import SEARCH_CANDIDATES, SEARCH_TYPO_CUTOFF, SEARCH_VOCABULARY_SIZE, SEARCH_VOCABULARY_TTL
+
+# Search runs in two steps: the (is_resolved, message/disaster_type) text index finds
+# the SEARCH_CANDIDATES best candidates, RapidFuzz then rescores only those in native code.
+# $text has no typo tolerance, misspelt query words are first corrected against a
+# vocabulary of the words of the open requests, kept in sync with $inc like the clusters:
+# {"_id": word, "count": open requests containing it}
+
+WORD_PATTERN = re.compile(r"\w{2,}")
+MIN_CORRECTED_LENGTH = 4  # shorter words have too many near neighbours to guess from
+REBUILD_BATCH_SIZE = 1000
+
+_vocabulary = LRUCache(maxsize=1, ttl=SEARCH_VOCABULARY_TTL)
+
+def request_words(doc: dict) -> set:
+    """Lower-cased words of the message and type of an open request, empty when it adds none."""
+    if not doc or doc.get("is_resolved"):
+        return set()
+    text = f"{doc.get('disaster_type') or ''} {doc.get('message') or ''}".lower()
+    return {word for word in WORD_PATTERN.findall(text) if not word.isdigit()}
+
+def search_term_updates(changes):
+    """Vocabulary writes for (before, after) request pairs, like `cluster_updates`."""
+    increments = Counter()
+    for before, after in changes:
+        old, new = request_words(before), request_words(after)
+        for word in old - new:
+            increments[word] -= 1
+        for word in new - old:
+            increments[word] += 1
+    return [UpdateOne({"_id": word}, {"$inc": {"count": n}}, upsert=True)
+            for word, n in increments.items() if n != 0]
+
+def update_search_terms_many(changes):
+    operations = search_term_updates(changes)
+    if operations:
+        mongo.db.request_terms.bulk_write(operations, ordered=False)
+
+def update_search_terms(before: dict, after: dict):
+    """Keep the search vocabulary in sync with one request write, no round trip unless words changed."""
+    update_search_terms_many([(before, after)])
+
+def search_vocabulary() -> list:
+    """The SEARCH_VOCABULARY_SIZE most used words, cached per worker for SEARCH_VOCABULARY_TTL seconds."""
+    words = _vocabulary.get("words")
+    if words is None:
+        cursor = (mongo.db.request_terms.find({"count": {"$gt": 0}}, {"_id": 1})
+                  .sort("count", DESCENDING).limit(SEARCH_VOCABULARY_SIZE))
+        words = [doc["_id"] for doc in cursor]
+        _vocabulary.set("words", words)
+    return words
+
+def correct_query(words: list, vocabulary: list) -> list:
+    """The query words plus, for words missing from the vocabulary, their closest vocabulary words."""
+    known = set(vocabulary)
+    corrected = list(words)
+    for word in words:
+        if word in known or len(word) < MIN_CORRECTED_LENGTH:
+            continue
+        for match, _, _ in process.extract(word, vocabulary, scorer=fuzz.ratio,
+                                           score_cutoff=SEARCH_TYPO_CUTOFF, limit=3):
+            if match not in corrected:
+                corrected.append(match)
+    return corrected
+
+def search_requests(q: str, is_resolved: bool = False, lat: float = None, lon: float = None,
+                    radius_km: float = None, limit: int = 20):
+    """
+    Requests matching a free-text query, best first.
+
+    Args:
+        q (str): words to look for, typos are tolerated
+        is_resolved (bool): search resolved instead of open requests
+        lat, lon (float): center of the optional radius filter
+        radius_km (float): only requests within this many km of (lat, lon)
+        limit (int): maximum number of results
+
+    Returns:
+        tuple: (words searched for after correction, list of requests with `score` 0..100
+        and `distance` in km when a location is given)
+    """
+    words = list(dict.fromkeys(WORD_PATTERN.findall(q.lower())))
+    if not words:
+        return [], []
+    words = correct_query(words, search_vocabulary())
+
+    query = {"is_resolved": is_resolved, "$text": {"$search": " ".join(words)}}
+    if radius_km is not None:
+        query["location"] = {"$geoWithin": {"$centerSphere": [[float(lon), float(lat)], float(radius_km) / EARTH_RADIUS_KM]}}
+    candidates = list(mongo.db.disaster_requests.find(query, {**REQUEST_PROJECTION, "text_score": {"$meta": "textScore"}})
+                      .sort([("text_score", {"$meta": "textScore"})])
+                      .limit(SEARCH_CANDIDATES))
+    if not candidates:
+        return words, []
+
+    # fuzzy similarity of the query to every candidate at once, blended with the index score
+    texts = [f"{doc.get('disaster_type') or ''} {doc.get('message') or ''}" for doc in candidates]
+    fuzzy = process.cdist([q], texts, scorer=fuzz.WRatio, processor=utils.default_process, workers=1)[0]
+    text_scores = np.array([doc.pop("text_score") for doc in candidates])
+    scores = 0.5 * fuzzy + 50.0 * text_scores / text_scores.max()
+    if lat is not None and lon is not None:
+        distances = haversine(lat, lon, [doc["latitude"] for doc in candidates], [doc["longitude"] for doc in candidates])
+        for doc, distance in zip(candidates, distances.tolist()):
+            doc["distance"] = distance
+
+    order = np.argsort(-scores, kind="stable")[:int(limit)]
+    results = []
+    for index in order.tolist():
+        doc = candidates[index]
+        doc["score"] = round(float(scores[index]), 2)
+        results.append(doc)
+    return words, results
+
+def rebuild_search_terms():
+    """Recount the vocabulary from the open requests into a scratch collection and swap it in. Returns (requests, words)."""
+    counts = Counter()
+    total = 0
+    cursor = mongo.db.disaster_requests.find(
+        {"is_resolved": False}, {"message": 1, "disaster_type": 1, "is_resolved": 1}
+    ).batch_size(REBUILD_BATCH_SIZE)
+    for doc in cursor:
+        counts.update(request_words(doc))
+        total += 1
+
+    scratch = mongo.db.request_terms_rebuild
+    scratch.drop()
+    operations = []
+    for word, count in counts.items():
+        operations.append(InsertOne({"_id": word, "count": count}))
+        if len(operations) == REBUILD_BATCH_SIZE:
+            scratch.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        scratch.bulk_write(operations, ordered=False)
+
+    if counts:
+        for keys, options in INDEXES["request_terms"]:
+            scratch.create_index(keys, **options)
+        scratch.rename("request_terms", dropTarget=True)
+    else:
+        mongo.db.request_terms.delete_many({})
+    _vocabulary.clear()
+    return total, len(counts)
@@ -1,68 +1,362 @@
-from werkzeug.exceptions import InternalServerError
+from werkzeug.exceptions import InternalServerError, BadRequest
+from flask import Response, current_app, stream_with_context
 from app.database import mongo
 from typing import List
-from app.disaster_service.utils import haversine
+import base64
+import hashlib
+import heapq
+import json
+import queue
+from datetime import datetime, timezone, timedelta
+from app.geo import EARTH_RADIUS_KM, haversine
+from app.cache import GeoCellCache
+from app.config import TOMBSTONE_TTL_DAYS, REQUEST_CACHE_PRECISION, REQUEST_CACHE_SIZE, REQUEST_CACHE_TTL, REQUEST_CACHE_MAX_RADIUS_KM
 
-def find_valid_requests(username: str, is_resolved):
+STREAM_BATCH_SIZE = 500  # documents per cursor batch while streaming
+
+# open requests around each geohash cell for radius listings, the disaster write helpers invalidate it...
+common_requests_cache = GeoCellCache(precision=REQUEST_CACHE_PRECISION, maxsize=REQUEST_CACHE_SIZE, ttl=REQUEST_CACHE_TTL)
+
+REQUEST_PROJECTION = {
+    "_id": 1,
+    "username": 1,
+    "phone": 1,
+    "message": 1,
+    "disaster_type": 1,
+    "created_at": 1,
+    "priority_count": 1,
+    "priority_updated_at": 1,
+    "priority_score": 1,
+    "active_responders": 1,
+    # coordinates live in the GeoJSON `location`, still answered as latitude/longitude...
+    "latitude": {"$ifNull": [{"$arrayElemAt": ["$location.coordinates", 1]}, "$latitude"]},
+    "longitude": {"$ifNull": [{"$arrayElemAt": ["$location.coordinates", 0]}, "$longitude"]},
+    "location": 1,
+    "location_hint": 1
+}
+
+# fields of the delta sync changes, also the shape of the streamed request events
+CHANGE_PROJECTION = {**REQUEST_PROJECTION, "is_resolved": 1, "updated_at": 1}
+
+def project_request(doc: dict) -> dict:
+    """Python side of CHANGE_PROJECTION for a request (or tombstone) already in memory."""
+    shaped = {field: doc[field] for field, spec in CHANGE_PROJECTION.items() if spec == 1 and field in doc}
+    location = doc.get("location")
+    lon, lat = location["coordinates"] if location else (doc.get("longitude"), doc.get("latitude"))
+    shaped["latitude"], shaped["longitude"] = lat, lon
+    return shaped
+
+def encode_cursor(values: dict) -> str:
+    """Opaque `next` token holding the sort key of the last returned document."""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(token: str) -> dict:
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise BadRequest("Invalid next token")
+
+def _priority_order(doc: dict):
+    # python side of the (priority_score desc, _id desc) sort, unscored legacy requests go last
+    score = doc.get("priority_score")
+    return (score if score is not None else float("-inf"), doc["_id"])
+
+def _merge_tiers(cursors, limit: int = None):
+    """Merge cursors sorted by (priority_score, _id) descending into one stream, skipping
+    a request caught in both tiers halfway through its archival."""
+    previous = None
+    returned = 0
+    for doc in heapq.merge(*cursors, key=_priority_order, reverse=True):
+        if previous is not None and doc["_id"] == previous:
+            continue
+        previous = doc["_id"]
+        yield doc
+        returned += 1
+        if limit is not None and returned >= limit:
+            return
+
+def find_valid_requests(username: str, is_resolved, limit: int = None, after: str = None):
+    """
+    Requests of a user, highest priority_score first (ties by _id), served in order
+    by the (username, is_resolved, priority_score, _id) index. Resolved requests are
+    read from both the live collection and the archive.
+
+    Args:
+        username (str): owner of the requests
+        is_resolved (bool): resolved or open requests
+        limit (int): page size, None for all
+        after (str): `next` token of the previous page
+
+    Returns:
+        iterable: iterate it to get the documents
+    """
     try:
-        open_requests = mongo.db.disaster_requests.find(
-            {
-                "username": username,
-                "is_resolved": is_resolved
-            },
-            {
-                "_id": 1,
-                "username": 1,
-                "phone": 1,
-                "message": 1,
-                "disaster_type": 1,
-                "created_at": 1,
-                "priority_count": 1,
-                "priority_updated_at": 1,
-                "active_responders": 1,
-                "latitude": 1,
-                "longitude": 1,
-                "location": 1,
-                "location_hint": 1
-            }
-        )
-        return list(open_requests)
+        query = {
+            "username": username,
+            "is_resolved": is_resolved
+        }
+        if after:
+            last = decode_cursor(after)
+            if last.get("s") is None:
+                # unscored requests sort last, the cut is inside them
+                query["priority_score"] = None
+                query["_id"] = {"$lt": last["id"]}
+            else:
+                query["$or"] = [
+                    {"priority_score": {"$lt": last["s"]}},
+                    {"priority_score": last["s"], "_id": {"$lt": last["id"]}},
+                    {"priority_score": None}  # missing/null is below every number, $lt never matches it
+                ]
+        collections = [mongo.db.disaster_requests]
+        if is_resolved:
+            collections.append(mongo.db.disaster_requests_archive)
+
+        cursors = []
+        for collection in collections:
+            cursor = collection.find(query, REQUEST_PROJECTION) \
+                .sort([("priority_score", -1), ("_id", -1)]) \
+                .batch_size(STREAM_BATCH_SIZE)
+            if limit is not None:
+                cursor = cursor.limit(int(limit))
+            cursors.append(cursor)
+        if len(cursors) == 1:
+            return cursors[0]
+        return _merge_tiers(cursors, int(limit) if limit is not None else None)
+    except BadRequest as e:
+        raise e
     except Exception as e:
         raise InternalServerError(description=f"Search failed: {e}")
-    
-def find_common_requests():
+
+def valid_requests_next_token(page: list):
+    last = page[-1]
+    return encode_cursor({"s": last.get("priority_score"), "id": last["_id"]})
+
+def find_top_requests(limit: int):
+    """The `limit` open requests with the highest priority_score, read off the (is_resolved, priority_score) index."""
     try:
-        open_requests = mongo.db.disaster_requests.find(
-            {
-                "is_resolved": False
-            },
-            {
-                "_id": 1,
-                "username": 1,
-                "phone": 1,
-                "message": 1,
-                "disaster_type": 1,
-                "created_at": 1,
-                "priority_count": 1,
-                "priority_updated_at": 1,
-                "active_responders": 1,
-                "latitude": 1,
-                "longitude": 1,
-                "location": 1,
-                "location_hint": 1
-            }
-        )
-        return list(open_requests)
+        return list(mongo.db.disaster_requests.find({"is_resolved": False}, REQUEST_PROJECTION)
+                    .sort([("priority_score", -1), ("_id", -1)])
+                    .limit(int(limit)))
     except Exception as e:
         raise InternalServerError(description=f"Search failed: {e}")
     
-def sort_alerts_by_proximity(open_common_requests: list, target_lat: float, target_lon: float):
-    for request in open_common_requests:
-        if request["latitude"] and request["longitude"]:
-            request["distance"] = haversine(request["latitude"], request["longitude"], target_lat, target_lon)
-        else:
-            request["distance"] = float("inf")  # unknown or malformed location goes to the end
-
-    # Sort by distance
-    open_common_requests.sort(key=lambda x: x["distance"])
-    return open_common_requests
\ No newline at end of file
+def _nearest_page(cursor, limit: int):
+    """
+    The first `limit` documents of a $geoNear cursor in (distance, _id) order. The cursor
+    is already distance ordered, only the requests tied with the last one (same spot) are
+    read past `limit` so the page can be ordered by _id, as the `next` token expects.
+    """
+    docs = []
+    try:
+        for doc in cursor:
+            if len(docs) >= limit and (limit == 0 or doc["distance"] > docs[limit - 1]["distance"]):
+                break
+            docs.append(doc)
+    finally:
+        cursor.close()
+    docs.sort(key=lambda doc: (doc["distance"], doc["_id"]))
+    return docs[:limit]
+
+def find_common_requests(target_lat: float, target_lon: float, max_distance: float = None, limit: int = None, after: str = None):
+    """
+    Open requests nearest first, ranked by MongoDB with $geoNear on the 2dsphere `location` index.
+
+    Args:
+        target_lat (float): Latitude to sort by
+        target_lon (float): Longitude to sort by
+        max_distance (float): only requests within this many km, None for all
+        limit (int): maximum number of requests, None for all
+        after (str): `next` token of the previous page, pages are keyed on (distance, _id)
+
+    Returns:
+        CommandCursor or list: requests with 'distance' in km computed by the database,
+        a list in (distance, _id) order when `limit` is given
+    """
+    try:
+        geo_near = {
+            "near": {"type": "Point", "coordinates": [float(target_lon), float(target_lat)]},
+            "distanceField": "distance",
+            "distanceMultiplier": 0.001,  # meters -> km, same unit as before
+            "query": {"is_resolved": False},
+            "spherical": True
+        }
+        if max_distance is not None:
+            geo_near["maxDistance"] = float(max_distance) * 1000
+
+        pipeline = [{"$geoNear": geo_near}]
+        if after:
+            last = decode_cursor(after)
+            # the index skips everything closer, the exact (distance, _id) cut is done by $match
+            geo_near["minDistance"] = max(last["d"] * 1000 - 1, 0)
+            pipeline.append({"$match": {"$or": [
+                {"distance": {"$gt": last["d"]}},
+                {"distance": last["d"], "_id": {"$gt": last["id"]}}
+            ]}})
+        pipeline.append({"$project": {**REQUEST_PROJECTION, "distance": 1}})
+        if limit is None:
+            return mongo.db.disaster_requests.aggregate(pipeline, batchSize=STREAM_BATCH_SIZE)
+        # no $sort/$limit stage: $geoNear streams nearest first and stops when we stop reading
+        cursor = mongo.db.disaster_requests.aggregate(pipeline, batchSize=int(limit) + 1)
+        return _nearest_page(cursor, int(limit))
+    except BadRequest as e:
+        raise e
+    except Exception as e:
+        raise InternalServerError(description=f"Search failed: {e}")
+
+def _rank_candidates(candidates: list, target_lat: float, target_lon: float, max_distance: float, limit: int = None, after: str = None):
+    # exact (distance, _id) page for one point out of the candidate set of its cell
+    if not candidates:
+        return []
+    distances = haversine(float(target_lat), float(target_lon),
+                          [doc["latitude"] for doc in candidates], [doc["longitude"] for doc in candidates])
+    ranked = sorted(
+        ({**doc, "distance": distance} for doc, distance in zip(candidates, distances.tolist()) if distance <= max_distance),
+        key=lambda doc: (doc["distance"], doc["_id"])
+    )
+    if after:
+        last = decode_cursor(after)
+        ranked = [doc for doc in ranked if (doc["distance"], doc["_id"]) > (last["d"], last["id"])]
+    return ranked if limit is None else ranked[:int(limit)]
+
+def cached_common_requests(target_lat: float, target_lon: float, max_distance: float = None, limit: int = None, after: str = None):
+    """
+    `find_common_requests` as a list, served from the geo-cell cache when a `max_distance`
+    of at most REQUEST_CACHE_MAX_RADIUS_KM is given. An entry holds the open requests within
+    `max_distance` plus the cell half diagonal of the cell center, which covers the radius of
+    every point of the cell, and is ranked for each caller's exact point, so everyone in the
+    same cell shares it. Other listings go to the database.
+    """
+    if max_distance is None or float(max_distance) > REQUEST_CACHE_MAX_RADIUS_KM:
+        return list(find_common_requests(target_lat, target_lon, max_distance, limit, after))
+
+    max_distance = float(max_distance)
+    cell = common_requests_cache.cell(target_lat, target_lon)
+    key = (cell, max_distance)
+    candidates = common_requests_cache.get(key)
+    if candidates is None:
+        generation = common_requests_cache.generation  # a write during the query must not leave its result cached
+        center_lat, center_lon = common_requests_cache.center(cell)
+        # $geoNear measures on a 6378.1 km sphere, haversine on EARTH_RADIUS_KM: widen so nothing is missed
+        fetch_radius = (max_distance + common_requests_cache.half_diagonal(cell)) * 6378.1 / EARTH_RADIUS_KM
+        candidates = list(find_common_requests(center_lat, center_lon, fetch_radius))
+        common_requests_cache.set(key, cell, max_distance, candidates, generation)
+    return _rank_candidates(candidates, target_lat, target_lon, max_distance, limit, after)
+
+def common_requests_next_token(page: list):
+    last = page[-1]
+    return encode_cursor({"d": last["distance"], "id": last["_id"]})
+
+def parse_since(since: str) -> datetime:
+    """Parse a `since` watermark (ISO 8601, naive values are UTC) into an aware UTC datetime."""
+    try:
+        parsed = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        raise BadRequest("since must be an ISO 8601 timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def _change_query(since: datetime, target_lat: float = None, target_lon: float = None, max_distance: float = None):
+    query = {"updated_at": {"$gte": since}}
+    if max_distance is not None and target_lat is not None and target_lon is not None:
+        query["location"] = {"$geoWithin": {"$centerSphere": [
+            [float(target_lon), float(target_lat)], float(max_distance) / EARTH_RADIUS_KM
+        ]}}
+    return query
+
+def needs_full_sync(since: datetime) -> bool:
+    """Tombstones older than TOMBSTONE_TTL_DAYS are gone, a diff from before that would be incomplete."""
+    return since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_TTL_DAYS)
+
+def request_changes_watermark(since: datetime, target_lat: float = None, target_lon: float = None, max_distance: float = None):
+    """Latest `updated_at` among requests and tombstones matching the delta query, `since` if nothing changed."""
+    try:
+        query = _change_query(since, target_lat, target_lon, max_distance)
+        watermark = since
+        for collection in (mongo.db.disaster_requests, mongo.db.request_tombstones):
+            latest = collection.find_one(query, {"updated_at": 1}, sort=[("updated_at", -1)])
+            if latest is not None:
+                watermark = max(watermark, _as_utc(latest["updated_at"]))
+        return watermark
+    except Exception as e:
+        raise InternalServerError(description=f"Search failed: {e}")
+
+def find_request_changes(since: datetime, target_lat: float = None, target_lon: float = None, max_distance: float = None):
+    """
+    Requests inserted/updated/resolved since the watermark plus the ids cancelled since then.
+    `since` is inclusive so a write sharing the watermark millisecond is never missed,
+    clients apply changes idempotently by _id.
+
+    Returns:
+        dict: {"changes": [...], "deleted": [ids], "full_sync_required": False}
+    """
+    try:
+        query = _change_query(since, target_lat, target_lon, max_distance)
+        changes = mongo.db.disaster_requests.find(query, CHANGE_PROJECTION).sort("updated_at", 1)
+        deleted = mongo.db.request_tombstones.find(query, {"_id": 1}).sort("updated_at", 1)
+        return {
+            "changes": list(changes),
+            "deleted": [doc["_id"] for doc in deleted],
+            "full_sync_required": False
+        }
+    except Exception as e:
+        raise InternalServerError(description=f"Search failed: {e}")
+
+def changes_etag(since: datetime, watermark: datetime, *filters) -> str:
+    key = json.dumps([since.isoformat(), watermark.isoformat(), *filters], default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def stream_json_array(docs):
+    """Stream an iterable of documents as one JSON array, written while the cursor yields."""
+    def generate():
+        yield "["
+        for position, doc in enumerate(docs):
+            yield ("," if position else "") + current_app.json.dumps(doc)
+        yield "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+def stream_request_events(bus, lat: float, lon: float, radius_km: float, heartbeat: float):
+    """
+    Server-Sent Events response of the request events within `radius_km` of (lat, lon),
+    a comment line is sent every `heartbeat` seconds so proxies keep the connection open.
+    Requests are sent in the shape of the delta sync changes (CHANGE_PROJECTION).
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        # subscribed on the first read, a client gone before that leaves nothing behind
+        subscription = bus.subscribe(lat, lon, radius_km)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                data = event.get("data")
+                if data is None:
+                    # shaped once per event, every subscriber gets the same text
+                    data = event["data"] = dumps(project_request(event["request"]))
+                yield f"event: {event['type']}\nid: {event['id']}\ndata: {data}\n\n"
+        finally:
+            # runs when the client disconnects and the server closes the generator
+            bus.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx must not buffer the stream
+    return response
+
+def paginated(docs, limit: int, next_token):
+    """Page body {"items": [...], "next": token or None}, `docs` holds at most limit+1 documents."""
+    items = list(docs)
+    has_more = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "next": next_token(items) if has_more and items else None
+    }
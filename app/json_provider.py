@@ -0,0 +1,22 @@
+import json
+from datetime import datetime, timezone
+from bson import json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+from flask_pymongo.helpers import BSONProvider
+
+class ISODateJSONProvider(BSONProvider):
+    """
+    flask_pymongo's BSON provider, but datetimes are written as plain ISO 8601 UTC
+    strings (what the clients parse) instead of extended JSON {"$date": ...}.
+    """
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, datetime):
+            # pymongo hands back naive datetimes, they are UTC
+            return (o if o.tzinfo is not None else o.replace(tzinfo=timezone.utc)).isoformat()
+        return json_util.default(o, json_options=RELAXED_JSON_OPTIONS)
+
+    def dumps(self, obj, **kwargs) -> str:
+        kwargs.setdefault("default", self._default)
+        return json.dumps(obj, **kwargs)
@@ -1,11 +1,12 @@
 import os
 import json
-import math
 import logging
 from flask import Flask, request, render_template_string
 import requests
+import numpy as np
 from shapely.geometry import shape, Point
 from shapely.prepared import prep
+from app.geo import haversine_meters, destination_points, top_k_nearest
 try:
     from rtree import index as rtree_index
     RTREE_AVAILABLE = True
@@ -36,21 +37,16 @@ MED_RAIN_THRESHOLD = 5.0
 BFE_SAFETY_MARGIN_M = 0.0
 BFE_GEOJSON_PATH = os.getenv("BFE_GEOJSON_PATH", "bfe.geojson")
 
-# ---------- Utilities ----------
-def haversine_meters(lat1, lon1, lat2, lon2):
-    R = 6371000.0
-    phi1 = math.radians(lat1); phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1); dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2.0)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2.0)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
 
 # -------- BFE support (loader + query) --------
 _BFE_FEATURES = []
+_BFE_CENTROIDS = np.empty((0, 2))  # (lat, lon) per feature, for the vectorized nearest fallback
 _RTREE_IDX = None
 
 def load_bfe_geojson(path=BFE_GEOJSON_PATH):
-    global _BFE_FEATURES, _RTREE_IDX
+    global _BFE_FEATURES, _BFE_CENTROIDS, _RTREE_IDX
     _BFE_FEATURES = []
+    _BFE_CENTROIDS = np.empty((0, 2))
     _RTREE_IDX = None
     if not os.path.isfile(path):
         # app.logger.info("No BFE geojson found at %s — skipping BFE loading.", path)
@@ -94,6 +90,8 @@ def load_bfe_geojson(path=BFE_GEOJSON_PATH):
         if _RTREE_IDX is not None:
             minx, miny, maxx, maxy = geom.bounds
             _RTREE_IDX.insert(idx, (minx, miny, maxx, maxy))
+    if _BFE_FEATURES:
+        _BFE_CENTROIDS = np.array([feat["centroid"] for feat in _BFE_FEATURES], dtype=float)
     # app.logger.info("Loaded %d BFE features from %s", len(_BFE_FEATURES), path)
     return len(_BFE_FEATURES)
 
@@ -122,15 +120,8 @@ def get_bfe_for_point(lat, lon, nearest_fallback=True):
             continue
     if not nearest_fallback:
         return None
-    best = None
-    for feat in _BFE_FEATURES:
-        clat, clon = feat["centroid"]
-        d = haversine_meters(lat, lon, clat, clon)
-        if best is None or d < best[0]:
-            best = (d, feat)
-    if best:
-        return best[1]["bfe"]
-    return None
+    dists = haversine_meters(lat, lon, _BFE_CENTROIDS[:, 0], _BFE_CENTROIDS[:, 1])
+    return _BFE_FEATURES[int(np.argmin(dists))]["bfe"]
 
 # load BFE at startup (if exists)
 bfe_count = load_bfe_geojson(BFE_GEOJSON_PATH)
@@ -183,10 +174,13 @@ def find_nearby_pois(lat, lon, radius=POI_SEARCH_RADIUS):
             tags = el.get("tags", {})
             name = tags.get("name")
             amen = tags.get("amenity") or tags.get("emergency") or tags.get("building")
-            dist = haversine_meters(lat, lon, elat, elon)
-            pois.append({"lat": elat, "lon": elon, "distance_m": dist, "name": name, "type": amen, "tags": tags})
-        pois.sort(key=lambda x: x["distance_m"])
-        return pois[:30]
+            pois.append({"lat": elat, "lon": elon, "name": name, "type": amen, "tags": tags})
+        if not pois:
+            return []
+        dists = haversine_meters(lat, lon, [p["lat"] for p in pois], [p["lon"] for p in pois])
+        for p, d in zip(pois, dists.tolist()):
+            p["distance_m"] = d
+        return [pois[i] for i in top_k_nearest(dists, 30)]
     except Exception as e:
         # app.logger.warning("overpass POI failed: %s", e)
         return []
@@ -229,20 +223,13 @@ def find_nearest_high_ground(lat, lon, base_elev):
     step = 1000
     maxr = HIGH_GROUND_MAX_RADIUS
     for radius in range(step, maxr+1, step):
-        ring = []
-        for angle_deg in angles:
-            angle = math.radians(angle_deg)
-            R = 6378137.0
-            lat1 = math.radians(lat); lon1 = math.radians(lon)
-            lat2 = math.asin(math.sin(lat1)*math.cos(radius/R) + math.cos(lat1)*math.sin(radius/R)*math.cos(angle))
-            lon2 = lon1 + math.atan2(math.sin(angle)*math.sin(radius/R)*math.cos(lat1), math.cos(radius/R)-math.sin(lat1)*math.sin(lat2))
-            lat2d = math.degrees(lat2); lon2d = math.degrees(lon2)
-            ring.append((lat2d, lon2d))
+        ring_lats, ring_lons = destination_points(lat, lon, angles, radius)
+        ring = list(zip(ring_lats.tolist(), ring_lons.tolist()))
         elevs = fetch_elevation_batch(ring)
         for idx, e in enumerate(elevs):
             if e is not None and e >= target:
                 found_lat, found_lon = ring[idx]
-                dist = haversine_meters(lat, lon, found_lat, found_lon)
+                dist = float(haversine_meters(lat, lon, found_lat, found_lon))
                 return {"lat": found_lat, "lon": found_lon, "elevation_m": round(e,2), "distance_m": dist}
     return None
 
@@ -263,20 +250,14 @@ def route_osrm(lat1, lon1, lat2, lon2):
 
 # ---------- Low-elevation sampling using BFE when available ----------
 def sample_low_elevation_areas_bfe(lat, lon, radii=LOW_AREA_SAMPLE_RADII, angles_count=LOW_AREA_SAMPLE_ANGLES, safety_margin_m=BFE_SAFETY_MARGIN_M):
-    pts = []
-    meta = []
-    for r in radii:
-        for i in range(angles_count):
-            angle = 2 * math.pi * (i / angles_count)
-            R = 6378137.0
-            lat1 = math.radians(lat); lon1 = math.radians(lon)
-            lat2 = math.asin(math.sin(lat1)*math.cos(r/R) + math.cos(lat1)*math.sin(r/R)*math.cos(angle))
-            lon2 = lon1 + math.atan2(math.sin(angle)*math.sin(r/R)*math.cos(lat1), math.cos(r/R)-math.sin(lat1)*math.sin(lat2))
-            lat2d = math.degrees(lat2); lon2d = math.degrees(lon2)
-            pts.append((lat2d, lon2d))
-            meta.append({"r": r, "angle_deg": int(math.degrees(angle))})
-    if not pts:
+    if not radii or not angles_count:
         return []
+    # every (radius, angle) combination in one vectorized call, radius-major like before
+    angles_deg = np.degrees(2 * np.pi * (np.arange(angles_count) / angles_count))
+    radius_grid, angle_grid = np.meshgrid(np.asarray(radii, dtype=float), angles_deg, indexing="ij")
+    pt_lats, pt_lons = destination_points(lat, lon, angle_grid.ravel(), radius_grid.ravel())
+    pts = list(zip(pt_lats.tolist(), pt_lons.tolist()))
+    meta = [{"r": r, "angle_deg": int(a)} for r in radii for a in angles_deg.tolist()]
     elevs = fetch_elevation_batch(pts)
     low_points = []
     for (pt, m, e) in zip(pts, meta, elevs):
@@ -1,6 +1,21 @@
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash
 import uuid
+from app.priority import priority_weight, initial_priority_score
+
+def user_location(value):
+    """GeoJSON point of a {"lat", "lon"} location, None when it has no valid coordinates."""
+    if not isinstance(value, dict):
+        return None
+    try:
+        lat, lon = float(value.get("lat")), float(value.get("lon"))
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value.get("lat"), bool) or isinstance(value.get("lon"), bool):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):  # also rejects NaN
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
 
 def user_model(data):
     return {
@@ -13,7 +28,8 @@ def user_model(data):
         "is_verified": False,
         "is_verified_ngo": False,
         "last_active_location": data["location"] if "location" in data else {"lat": None, "lon": None},
-        "registered_at": datetime.utcnow().isoformat(),
+        "location": user_location(data.get("location")), # GeoJSON [lon, lat] of last_active_location, 2dsphere indexed for responder matching...
+        "registered_at": datetime.now(timezone.utc),
         "is_active": True, # if violations reach a threshold account will be blocked...
         "roles": ["user"],
         "meta": {
@@ -30,13 +46,15 @@ def user_disaster_model(data):
         "_id": str(uuid.uuid4()),
         "username": data["username"],
         "phone": data["phone"],
-        "latitude": float(data["latitude"]),
-        "longitude": float(data["longitude"]),
+        "location": {"type": "Point", "coordinates": [float(data["longitude"]), float(data["latitude"])]}, # GeoJSON [lon, lat], 2dsphere indexed...
         "message": data["message"] if "message" in data else "",
         "disaster_type": data["disaster_type"] if "disaster_type" in data else "",
-        "created_at": datetime.utcnow().isoformat(),
+        "created_at": datetime.now(timezone.utc),
         "is_resolved": False,
         "priority_count": 1,
-        "priority_updated_at": datetime.now(timezone.utc).isoformat(),
+        "priority_updated_at": datetime.now(timezone.utc),
+        "priority_weight": priority_weight(data.get("disaster_type")), # by disaster type, fixed per request...
+        "priority_score": initial_priority_score(data.get("disaster_type")), # time-decayed rank (log2), see app/priority.py
+        "updated_at": datetime.now(timezone.utc), # bumped by every write, delta sync watermark...
         "active_responders": [] # each {"username": str, "phone": str, "email": str}
     }
\ No newline at end of file
@@ -0,0 +1,88 @@
+import math
+from datetime import datetime, timezone
+from app.config import PRIORITY_HALF_LIFE_HOURS, PRIORITY_EPOCH
+
+# Time-decayed priority:
+#   score(now) = weight(type) * sum over bumps of 2 ** -((now - bumped_at) / half_life)
+# Every term shares the factor 2 ** -(now - epoch) / half_life, so ranking by
+#   weight(type) * sum over bumps of 2 ** ((bumped_at - epoch) / half_life)
+# gives the same order at any time. That sum doubles every half-life, so it is stored
+# as its log2 (log-sum-exp of the bump exponents):
+#   priority_score = log2(weight) + log2(sum over bumps of 2 ** ((bumped_at - epoch) / half_life))
+# which grows by about 1 per half-life and never overflows. A bump only ever raises the
+# stored score, it is applied atomically on the server and the score can live in an index.
+
+EPOCH = datetime.fromisoformat(PRIORITY_EPOCH)
+
+# matched against the lower-cased free text disaster_type, first hit wins...
+TYPE_WEIGHTS = [
+    ("medical", 2.0),
+    ("trapped", 2.0),
+    ("fire", 1.8),
+    ("collapse", 1.8),
+    ("electric", 1.5),
+    ("flood", 1.5),
+    ("landslide", 1.5),
+    ("food", 1.2),
+    ("water", 1.2),
+]
+
+def priority_weight(disaster_type) -> float:
+    text = str(disaster_type or "").lower()
+    for keyword, weight in TYPE_WEIGHTS:
+        if keyword in text:
+            return weight
+    return 1.0
+
+def _as_utc(at):
+    if isinstance(at, str):
+        at = datetime.fromisoformat(at)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)  # created_at is stored as naive UTC
+    return at
+
+def priority_bump(at=None) -> float:
+    """log2 of the score one prioritize call adds (before the type weight), `at` defaults to now."""
+    at = _as_utc(at) if at is not None else datetime.now(timezone.utc)
+    return (at - EPOCH).total_seconds() / (PRIORITY_HALF_LIFE_HOURS * 3600.0)
+
+def initial_priority_score(disaster_type, at=None) -> float:
+    """priority_score of a new request, its creation counts as the first bump."""
+    return math.log2(priority_weight(disaster_type)) + priority_bump(at)
+
+def add_priority(score, weight, bump: float) -> float:
+    """Python side of `priority_bump_expression`: log2(2 ** score + weight * 2 ** bump)."""
+    term = math.log2(weight or 1.0) + bump
+    if score is None:
+        return term
+    return max(score, term) + math.log2(1.0 + 2.0 ** -abs(score - term))
+
+def priority_bump_expression(bump: float) -> dict:
+    """Update pipeline expression adding one weighted bump to priority_score (log-sum-exp, exact in log space)."""
+    return {"$let": {
+        "vars": {
+            "score": "$priority_score",
+            "term": {"$add": [{"$log": [{"$ifNull": ["$priority_weight", 1]}, 2]}, bump]}
+        },
+        "in": {"$cond": [
+            {"$eq": [{"$ifNull": ["$$score", None]}, None]},
+            "$$term",
+            {"$add": [
+                {"$max": ["$$score", "$$term"]},
+                {"$log": [{"$add": [1, {"$pow": [2, {"$multiply": [-1, {"$abs": {"$subtract": ["$$score", "$$term"]}}]}]}]}, 2]}
+            ]}
+        ]}
+    }}
+
+def estimate_priority_score(doc: dict) -> float:
+    """
+    Score of a stored request from its fields (creation counts as the first bump and
+    only the last bump time is known), used to backfill.
+    """
+    created_at = doc.get("created_at") or doc.get("priority_updated_at")
+    bumped_at = doc.get("priority_updated_at") or created_at
+    bumps = max(int(doc.get("priority_count") or 1), 1)
+    score = priority_bump(created_at) if created_at else priority_bump()
+    if bumps > 1:
+        score = add_priority(score, bumps - 1, priority_bump(bumped_at) if bumped_at else priority_bump())
+    return math.log2(priority_weight(doc.get("disaster_type"))) + score
@@ -0,0 +1,41 @@
+# micro-benchmark of the vectorized geo kernel against the per-element loops it replaced
+# usage: python -m scripts.bench_geo (from the repository root)
+import math
+import time
+import numpy as np
+from app.geo import haversine, top_k_nearest
+
+def haversine_loop(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    a = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+    return 2 * math.asin(math.sqrt(a)) * 6371
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    rng = np.random.default_rng(0)
+    target_lat, target_lon = 19.1334, 72.9133  # IIT Bombay
+    for n in (10_000, 1_000_000):
+        lats = rng.uniform(8.0, 35.0, n)  # roughly India
+        lons = rng.uniform(68.0, 97.0, n)
+        lat_list, lon_list = lats.tolist(), lons.tolist()
+
+        def loop_rank():
+            distances = [haversine_loop(lat, lon, target_lat, target_lon) for lat, lon in zip(lat_list, lon_list)]
+            return sorted(range(n), key=distances.__getitem__)[:30]
+
+        def kernel_rank():
+            return top_k_nearest(haversine(lats, lons, target_lat, target_lon), 30)
+
+        loop_t = timed(loop_rank, repeat=1 if n > 100_000 else 3)
+        kernel_t = timed(kernel_rank)
+        print(f"n={n:>9,}  loop+sort {loop_t*1000:9.1f} ms   numpy+argpartition {kernel_t*1000:8.1f} ms   speedup x{loop_t/kernel_t:.1f}")
+
+if __name__ == "__main__":
+    main()